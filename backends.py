@@ -0,0 +1,210 @@
+import sys
+import time
+import pandas as pd # type: ignore
+import numpy as np # type: ignore
+import scipy.sparse as sp # type: ignore
+from scipy.optimize import milp, LinearConstraint, Bounds # type: ignore
+from model import gp, GRB, get_data, get_model_arrays, get_scenarios, group_gozinto_signatures, set_parameters # type: ignore
+from scenarios import legacy_normal_demand # type: ignore
+
+BACKENDS = ('gurobi', 'highs')
+
+# Status of the solutions, with the same codes of GRB.Status so that the solutions of all the backends
+# can be compared (and stored in the SolveCache) in the same way
+OPTIMAL = 2
+INFEASIBLE = 3
+UNBOUNDED = 5
+TIME_LIMIT = 9
+OTHER = 0
+
+class ATOProblem:
+    #
+    # This class is the description of the extensive form of the ATO problem with stochastic demand
+    # that does not depend on the solver: it is built once from the data and solved with any backend of solve_problem
+    # The variables are y (row j*n_scenarios + s is the amount of product j produced in scenario s), x and,
+    # when the components are grouped by gozinto signature, the continuous capacities z of the groups; the problem is
+    #   max c @ v   s.t.   A @ v <= b,   lb <= v <= ub,   v[integrality == 1] integer
+    # where A has the working_hours rows and the gozinto rows (as in build_model_variables),
+    # while the qty_products constraints are the upper bounds of y.
+    # All the matrices are sparse so that the size of the problem only grows with the nonzeros of the data.
+    #
+    # INPUTS:
+    # df1, products_price, machine_daily_time, demand, prob, path, aggregate_gozinto: as in gurobi_model_variables
+    #
+    # ATTRIBUTES:
+    # c, A, b, lb, ub: objective, sparse constraint matrix (csr), right hand side and bounds of the variables
+    # integrality: array with 1 for the integer variables and 0 for the continuous ones
+    # num_components, num_items, num_scenarios: size of the problem
+    # build_time: time in seconds spent to build it
+    #
+    def __init__(self, df1:pd.DataFrame = None, products_price:dict = None, machine_daily_time:dict = None, demand:list = None, prob:list = None, path:str = None, aggregate_gozinto:bool = True):
+        if df1 is None:
+            df1, products_price, machine_daily_time, products, num_components, num_items, num_machines = get_data(path = path)
+
+        start_time = time.perf_counter()
+        processing_time, gozinto, cost, price, machine_time = get_model_arrays(df1, products_price, machine_daily_time, sparse = True)
+        self.num_components, self.num_items = gozinto.shape
+        demand, prob = get_scenarios(demand, prob, self.num_items)
+        self.num_scenarios = len(demand)
+        num_machines = len(machine_time)
+        num_y = self.num_items * self.num_scenarios
+
+        signatures, linking = group_gozinto_signatures(gozinto) if aggregate_gozinto else (None, None)
+        num_z = 0 if signatures is None else signatures.shape[0]
+
+        self.c = np.concatenate([np.outer(price, prob).reshape(-1), -cost, np.zeros(num_z)])
+        working_hours = sp.hstack([sp.csr_matrix((num_machines, num_y)), sp.csr_matrix(processing_time.T), sp.csr_matrix((num_machines, num_z))])
+        if signatures is None:
+            # row i*n_scenarios + s is sum_j gozinto[i, j] * y[j, s] - x[i] <= 0
+            gozinto_matrix = sp.hstack([
+                sp.kron(sp.csr_matrix(gozinto), sp.identity(self.num_scenarios)),
+                -sp.kron(sp.identity(self.num_components), np.ones((self.num_scenarios, 1)))
+            ])
+        else:
+            # row g*n_scenarios + s is sum_j signatures[g, j] * y[j, s] - z[g] <= 0, then the rows z[g] - x[i] <= 0
+            gozinto_matrix = sp.vstack([
+                sp.hstack([sp.kron(signatures, sp.identity(self.num_scenarios)), sp.csr_matrix((num_z*self.num_scenarios, self.num_components)),
+                           -sp.kron(sp.identity(num_z), np.ones((self.num_scenarios, 1)))]),
+                sp.hstack([sp.csr_matrix((linking.shape[0], num_y)), linking[:, num_z:], linking[:, :num_z]])
+            ])
+        self.A = sp.vstack([working_hours, gozinto_matrix], format='csr')
+        self.b = np.concatenate([machine_time*7, np.zeros(gozinto_matrix.shape[0])])
+        self.lb = np.zeros(num_y + self.num_components + num_z)
+        self.ub = np.concatenate([demand.T.reshape(-1), np.full(self.num_components + num_z, np.inf)])
+        self.integrality = np.concatenate([np.ones(num_y + self.num_components), np.zeros(num_z)])
+        self.build_time = time.perf_counter() - start_time
+
+    def split(self, values:np.ndarray):
+        # Returns y array (n_products, n_scenarios) and x array (n_components,) from the values of all the variables
+        num_y = self.num_items * self.num_scenarios
+        return (values[:num_y].reshape(self.num_items, self.num_scenarios), values[num_y:num_y + self.num_components])
+
+class ProblemSolution:
+    #
+    # This class is the solution of an ATOProblem found by one of the backends
+    #
+    # ATTRIBUTES:
+    # objVal: objective value of the best solution found (the optimum when status is OPTIMAL), None when no solution is found
+    # obj_bound: bound of the optimal objective value, None when it is not known
+    # mip_gap: relative gap between objVal and obj_bound, None when it is not known
+    # status: status of the solve (OPTIMAL, INFEASIBLE, UNBOUNDED, TIME_LIMIT or OTHER)
+    # Runtime: time in seconds spent by the solver
+    # x: array (n_components,) with the number of each component, None when no solution is found
+    # y: array (n_products, n_scenarios) with the amount of each product produced in each scenario, None when no solution is found
+    # backend: name of the backend
+    #
+    def __init__(self, objVal:float, status:int, Runtime:float, x:np.ndarray, y:np.ndarray, backend:str, obj_bound:float = None, mip_gap:float = None):
+        self.objVal = objVal
+        self.obj_bound = obj_bound
+        self.mip_gap = mip_gap
+        self.status = status
+        self.Runtime = Runtime
+        self.x = x
+        self.y = y
+        self.backend = backend
+
+    def is_acceptable(self, accept_gap:float = None):
+        # True if the solution is optimal or, when accept_gap is not None, its gap from the bound is at most accept_gap
+        if self.status == OPTIMAL:
+            return True
+        return accept_gap is not None and self.objVal is not None and self.mip_gap is not None and self.mip_gap <= accept_gap
+
+def solve_problem(problem:ATOProblem, backend:str = 'gurobi', threads:int = None, time_limit:float = None, mip_gap:float = None, recorder = None, **info):
+    #
+    # This function solves the ATOProblem with the chosen backend
+    #
+    # INPUTS:
+    # problem: ATOProblem
+    # backend: 'gurobi' or 'highs' (HiGHS through scipy.optimize.milp, it does not need any license)
+    # threads: value of the gurobi parameter Threads (None for the default), HiGHS through scipy is single-threaded
+    # time_limit: maximum time in seconds of the solve, None for no limit
+    # mip_gap: relative gap at which the solve stops, None for the default of the backend
+    # recorder: instrumentation.SolveRecorder where the statistics of the solve are recorded (with info), None to record nothing
+    #
+    # OUTPUT:
+    # solution: ProblemSolution
+    #
+    if backend == 'gurobi':
+        return _solve_gurobi(problem, threads, time_limit, mip_gap, recorder, info)
+    if backend == 'highs':
+        return _solve_highs(problem, time_limit, mip_gap, recorder, info)
+    raise ValueError(f"Unknown backend '{backend}'")
+
+def _solve_gurobi(problem:ATOProblem, threads:int = None, time_limit:float = None, mip_gap:float = None, recorder = None, info:dict = None):
+    if gp is None:
+        raise ImportError("The 'gurobi' backend needs gurobipy, use backend='highs' without a gurobi license")
+    model = gp.Model("ato")
+    model.setParam('OutputFlag', 0)
+    set_parameters(model, threads, time_limit, mip_gap)
+    vtype = np.where(problem.integrality == 1, GRB.INTEGER, GRB.CONTINUOUS)
+    v = model.addMVar(len(problem.c), lb=problem.lb, ub=problem.ub, vtype=vtype, obj=problem.c, name="v")
+    model.ModelSense = GRB.MAXIMIZE
+    model.addMConstr(problem.A, v, '<', problem.b, name="constraints")
+    model._build_time = problem.build_time
+    if recorder is None:
+        model.optimize()
+    else:
+        recorder.optimize(model, n_scenarios = problem.num_scenarios, **(info or {}))
+
+    status = model.status if model.status in (OPTIMAL, INFEASIBLE, UNBOUNDED, TIME_LIMIT) else OTHER
+    if model.SolCount == 0:
+        solution = ProblemSolution(None, status, model.Runtime, None, None, 'gurobi')
+    else:
+        y, x = problem.split(v.X)
+        solution = ProblemSolution(model.objVal, status, model.Runtime, x, y, 'gurobi', model.ObjBound, model.MIPGap)
+    model.dispose()
+    return solution
+
+def _solve_highs(problem:ATOProblem, time_limit:float = None, mip_gap:float = None, recorder = None, info:dict = None):
+    options = {'disp': False}
+    if time_limit is not None:
+        options['time_limit'] = time_limit
+    if mip_gap is not None:
+        options['mip_rel_gap'] = mip_gap
+    start_time = time.perf_counter()
+    # milp minimizes, the objective is changed of sign
+    result = milp(-problem.c, integrality=problem.integrality, bounds=Bounds(problem.lb, problem.ub),
+                  constraints=LinearConstraint(problem.A, -np.inf, problem.b), options=options)
+    runtime = time.perf_counter() - start_time
+
+    # status of scipy.optimize.milp: 0 optimal, 1 iteration or time limit, 2 infeasible, 3 unbounded
+    status = {0: OPTIMAL, 1: TIME_LIMIT, 2: INFEASIBLE, 3: UNBOUNDED}.get(result.status, OTHER)
+    if recorder is not None:
+        # scipy does not report the number of simplex iterations nor the trajectory
+        recorder.add({'backend': 'highs', 'from_cache': False, 'status': status,
+                      'objVal': None if result.x is None else -result.fun,
+                      'obj_bound': None if getattr(result, 'mip_dual_bound', None) is None else -result.mip_dual_bound,
+                      'mip_gap': getattr(result, 'mip_gap', None), 'build_time': problem.build_time, 'runtime': runtime,
+                      'node_count': getattr(result, 'mip_node_count', None), 'iter_count': None,
+                      'n_scenarios': problem.num_scenarios, **(info or {})})
+    if result.x is None:
+        return ProblemSolution(None, status, runtime, None, None, 'highs')
+    y, x = problem.split(np.round(result.x))
+    obj_bound = None if getattr(result, 'mip_dual_bound', None) is None else -result.mip_dual_bound
+    return ProblemSolution(-result.fun, status, runtime, x, y, 'highs', obj_bound, getattr(result, 'mip_gap', None))
+
+def check_backend_parity(n_scenario:int = 10, seed:int = 42, path:str = None, rtol:float = 1e-6):
+    #
+    # This function solves the model of the data in the 'data' folder on n_scenario sampled scenarios
+    # with all the backends and checks that they find the same optimal objective value
+    # (only the backends that are installed are compared)
+    #
+    # OUTPUT:
+    # objVals: dictionary with the objective value of each backend
+    # parity: True if all the objective values are equal up to the relative tolerance rtol
+    #
+    df1, products_price, machine_daily_time, products, num_components, num_items, num_machines = get_data(path = path)
+    problem = ATOProblem(df1, products_price, machine_daily_time, demand = legacy_normal_demand(seed, n_scenario, num_items))
+    objVals = {backend: solve_problem(problem, backend).objVal for backend in BACKENDS if backend != 'gurobi' or gp is not None}
+    values = list(objVals.values())
+    parity = all(value is not None for value in values) and np.allclose(values, values[0], rtol=rtol, atol=0)
+    return (objVals, parity)
+
+if __name__ == '__main__':
+    objVals, parity = check_backend_parity()
+    for backend, objVal in objVals.items():
+        print(f'{backend}: {objVal}')
+    print('The backends agree' if parity else 'The backends DO NOT agree')
+    # a backend without a solution also fails the check, so that it can be used in a CI job
+    if not parity:
+        sys.exit(1)
@@ -0,0 +1,139 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np # type: ignore
+
+# Metrics compared against the baseline (the lower the better)
+METRICS = ['load_time', 'build_time', 'solve_time', 'peak_memory_mb', 'in_sample_time', 'out_sample_time']
+# Sizes of the single tiny case of --smoke (components, products, machines, scenarios), small enough for the restricted gurobi license
+SMOKE_CASE = (50, 5, 3, 5)
+
+def run_case(num_components:int, num_products:int, num_machines:int, num_scenarios:int, density:float = 0.02, seed:int = 0, time_limit:float = None, stability_iterations:int = 0):
+    #
+    # This function generates a synthetic instance with data/main_generate_data.generate_sparse_instance and measures
+    # the time to load its data, to build and to solve the model on num_scenarios scenarios and, if
+    # stability_iterations > 0, the wall time of the two stability analyses with max_iterations = stability_iterations.
+    # ATTENTION: the peak memory is the one of the whole process, run_case should be called in a new process
+    #
+    # OUTPUT:
+    # dictionary with the size of the instance and the measures
+    #
+    from data.main_generate_data import generate_sparse_instance, write_instance # type: ignore
+    import model # type: ignore
+    from main_stability import compute_in_sample_stability, compute_out_sample_stability # type: ignore
+
+    result = {'components': num_components, 'products': num_products, 'machines': num_machines, 'scenarios': num_scenarios}
+    with tempfile.TemporaryDirectory() as folder:
+        os.makedirs(f'{folder}/data')
+        df, products_selling_price, machine_daily_time = generate_sparse_instance(num_components, num_products, num_machines, density, seed=seed)
+        write_instance(df, products_selling_price, machine_daily_time, f'{folder}/data/')
+
+        start_time = time.perf_counter()
+        df1, products_price, machine_daily_time, products, num_components, num_items, num_machines = model.get_data(path=f'{folder}/')
+        result['load_time'] = time.perf_counter() - start_time
+
+    rng = np.random.default_rng(seed)
+    demand = np.clip(rng.normal(loc=100, scale=40, size=(num_scenarios, num_items)).astype(int), 0, None)
+    (model_stochastic, y, x) = model.build_model_variables(df1=df1, products_price=products_price, machine_daily_time=machine_daily_time, demand=demand)
+    result['build_time'] = model_stochastic._build_time
+    model.set_parameters(model_stochastic, time_limit = time_limit)
+    model_stochastic.optimize()
+    result['solve_time'] = model_stochastic.Runtime
+    result['status'] = model_stochastic.status
+    result['objVal'] = model_stochastic.objVal if model_stochastic.SolCount > 0 else None
+    model_stochastic.dispose()
+
+    if stability_iterations > 0:
+        start_time = time.perf_counter()
+        compute_in_sample_stability(max_iterations=stability_iterations, df1=df1, products_price=products_price, machine_daily_time=machine_daily_time)
+        result['in_sample_time'] = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        compute_out_sample_stability(max_iterations=stability_iterations, df1=df1, products_price=products_price, machine_daily_time=machine_daily_time)
+        result['out_sample_time'] = time.perf_counter() - start_time
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result['peak_memory_mb'] = peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+    return result
+
+def run_benchmark(components:list, products:list, machines:list, scenarios:list, density:float = 0.02, seed:int = 0, time_limit:float = None, stability_iterations:int = 0):
+    #
+    # This function runs run_case for every combination of the sizes, each one in a new process
+    #
+    # OUTPUT:
+    # dictionary with the metadata of the run and the list of the results
+    #
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for num_components, num_products, num_machines, num_scenarios in itertools.product(components, products, machines, scenarios):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            result = executor.submit(run_case, num_components, num_products, num_machines, num_scenarios, density, seed, time_limit, stability_iterations).result()
+        print(json.dumps(result))
+        results.append(result)
+    metadata = {'python': platform.python_version(), 'platform': platform.platform(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'density': density, 'seed': seed, 'time_limit': time_limit, 'stability_iterations': stability_iterations}
+    return {'metadata': metadata, 'results': results}
+
+def compare_results(current:dict, baseline:dict, tolerance:float = 0.2):
+    #
+    # This function compares the results of a run with a baseline: a metric is a regression when it is more than
+    # (1 + tolerance) times the baseline value for the same instance size
+    #
+    # OUTPUT:
+    # list of dictionaries with the instance size, the metric, the two values and their ratio, for every regression
+    #
+    size = lambda result: (result['components'], result['products'], result['machines'], result['scenarios'])
+    baseline_results = {size(result): result for result in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        reference = baseline_results.get(size(result))
+        if reference is None:
+            continue
+        for metric in METRICS:
+            if result.get(metric) is None or not reference.get(metric):
+                continue
+            ratio = result[metric] / reference[metric]
+            if ratio > 1 + tolerance:
+                regressions.append({'size': size(result), 'metric': metric, 'baseline': reference[metric], 'current': result[metric], 'ratio': ratio})
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the ATO model on synthetic instances')
+    parser.add_argument('--components', type=int, nargs='+', default=[1000])
+    parser.add_argument('--products', type=int, nargs='+', default=[20])
+    parser.add_argument('--machines', type=int, nargs='+', default=[10])
+    parser.add_argument('--scenarios', type=int, nargs='+', default=[10, 100])
+    parser.add_argument('--density', type=float, default=0.02)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--time-limit', type=float, default=None, help='gurobi TimeLimit of every solve')
+    parser.add_argument('--stability-iterations', type=int, default=0, help='max_iterations of the timed stability analyses (0 to skip them)')
+    parser.add_argument('--output', type=str, default='benchmark_results.json')
+    parser.add_argument('--compare', type=str, default=None, help='baseline json file to compare the results with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='relative slowdown above which a metric is a regression')
+    parser.add_argument('--smoke', action='store_true', help='run only one tiny case (SMOKE_CASE) to check that the benchmark works')
+    args = parser.parse_args()
+    if args.smoke:
+        args.components, args.products, args.machines, args.scenarios = ([size] for size in SMOKE_CASE)
+        args.density = 0.2
+
+    current = run_benchmark(args.components, args.products, args.machines, args.scenarios, args.density, args.seed, args.time_limit, args.stability_iterations)
+    with open(args.output, 'w') as f:
+        json.dump(current, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare_results(current, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression['size']} {regression['metric']}: {regression['baseline']:.4g} -> {regression['current']:.4g} ({regression['ratio']:.2f}x)")
+        if regressions:
+            sys.exit(1)
+        print('No regressions with respect to the baseline')
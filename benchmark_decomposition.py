@@ -0,0 +1,50 @@
+import time
+from model import get_data, gurobi_model_variables, benders_model_variables # type: ignore
+from scenarios import legacy_normal_demand # type: ignore
+
+def benchmark_decomposition(scenario_counts:tuple = (10, 100, 1000, 5000), seed:int = 42, path:str = None):
+    #
+    # This function compares the extensive form (gurobi_model_variables) with the L-shaped method
+    # (benders_model_variables) on the data of the 'data' folder for an increasing number of scenarios
+    #
+    # INPUTS:
+    # scenario_counts: numbers of scenarios to test
+    # seed: seed used to sample the demand scenarios
+    # path: path to the data files if the function is called from a different directory
+    #
+    # OUTPUT:
+    # results: list of dictionaries with the number of scenarios, the objective values and the times of the two methods
+    #
+    df1, products_price, machine_daily_time, products, num_components, num_items, num_machines = get_data(path = path)
+
+    results = []
+    for n_scenario in scenario_counts:
+        demand = legacy_normal_demand(seed, n_scenario, num_items)
+
+        start_time = time.perf_counter()
+        model, y, x = gurobi_model_variables(df1=df1, products_price=products_price, machine_daily_time=machine_daily_time, demand=demand)
+        extensive_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        objVal_benders, x_benders, info = benders_model_variables(df1=df1, products_price=products_price, machine_daily_time=machine_daily_time, demand=demand, return_model=False)
+        benders_time = time.perf_counter() - start_time
+
+        results.append({
+            'n_scenario': n_scenario,
+            'extensive_objVal': None if model is None else model.objVal,
+            'extensive_build_time': None if model is None else model._build_time,
+            'extensive_time': extensive_time,
+            'benders_objVal': objVal_benders,
+            'benders_iterations': None if info is None else info['iterations'],
+            'benders_time': benders_time,
+        })
+    return results
+
+def _format(value, width:int, spec:str = ''):
+    # Formats a value of the report, 'n/a' when the solve did not return it (e.g. infeasible or stopped by a limit)
+    return f"{'n/a' if value is None else format(value, spec):>{width}}"
+
+if __name__ == '__main__':
+    print(f"{'scenarios':>10} {'extensive obj':>15} {'extensive s':>12} {'benders obj':>15} {'iterations':>10} {'benders s':>10}")
+    for result in benchmark_decomposition():
+        print(f"{result['n_scenario']:>10} {_format(result['extensive_objVal'], 15, '.2f')} {result['extensive_time']:>12.3f} {_format(result['benders_objVal'], 15, '.2f')} {_format(result['benders_iterations'], 10)} {result['benders_time']:>10.3f}")
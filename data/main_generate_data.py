@@ -1,5 +1,9 @@
 import pandas as pd # type: ignore
+import numpy as np # type: ignore
+import scipy.sparse as sp # type: ignore
+import argparse
 import csv
+import os
 
 ## COMPONENTS
 components_prices = {
@@ -407,19 +411,78 @@ processing_times = {
     }
 }
 
-df = pd.DataFrame.from_dict(processing_times, orient='index', columns=machines)
-df = pd.concat([df, data], axis=1)
-df['price'] = df.index.map(components_prices)
+def write_instance(df:pd.DataFrame, products_selling_price:dict, machine_daily_time:dict, file_path:str = 'data/'):
+    #
+    # This function writes the two csv files read by model.get_data
+    # df: dataframe with the processing time of each machine, the gozinto factor of each product and the price of each component
+    #
+    # the missing values of a sparse dataframe are written as 0 and not as empty cells
+    df.fillna(0).to_csv(f"{file_path}components_data.csv")
 
-df.to_csv(f"{file_path}components_data.csv")
+    with open(f'{file_path}products_machines.csv', 'w') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow([len(products_selling_price), len(machine_daily_time)])
+        for prod in products_selling_price:
+            writer.writerow([prod, products_selling_price[prod]])
+        for mac in machine_daily_time:
+            writer.writerow([mac, machine_daily_time[mac]])
 
-with open(f'{file_path}products_machines.csv', 'w') as csv_file:
-    writer = csv.writer(csv_file)
-    writer.writerow([len(products), len(machines)])
-    for prod in products:
-        writer.writerow([prod, products_selling_price[prod]])
-    for mac in machines:
-        writer.writerow([mac, machine_daily_time[mac]])
+def generate_sparse_instance(num_components:int = 10000, num_products:int = 200, num_machines:int = 50, density:float = 0.02, machines_per_component:int = 2, seed:int = 0):
+    #
+    # This function generates a large synthetic instance with the same schema of the laptop data, for benchmarking:
+    # every product uses about density * num_components components (gozinto factor from 1 to 3) and every component
+    # is processed by machines_per_component machines, so most of the processing times and gozinto factors are 0.
+    # The selling price of a product is 1.2-1.8 times the cost of its components and the daily time of a machine
+    # is 40%-120% of what a weekly demand of 100 units per product needs.
+    #
+    # OUTPUT:
+    # df: dataframe with (n_machines + n_products + 1) columns, with sparse columns
+    # products_selling_price: dictionary with the price of each product
+    # machine_daily_time: dictionary with the daily time in minutes available for each machine
+    #
+    rng = np.random.default_rng(seed)
+    components = [f"Component_{i}" for i in range(num_components)]
+    products = [f"Product_{j}" for j in range(num_products)]
+    machines = [f"Machine_{m}" for m in range(num_machines)]
 
+    gozinto = sp.random(num_components, num_products, density=density, format='csr', random_state=rng, data_rvs=lambda n: rng.integers(1, 4, size=n))
+    # every product needs at least one component
+    missing = np.flatnonzero(gozinto.getnnz(axis=0) == 0)
+    gozinto = gozinto + sp.csr_matrix((np.ones(len(missing)), (rng.integers(0, num_components, size=len(missing)), missing)), shape=gozinto.shape)
 
-    
+    rows = np.repeat(np.arange(num_components), machines_per_component)
+    columns = np.concatenate([rng.choice(num_machines, size=machines_per_component, replace=False) for i in range(num_components)])
+    processing_time = sp.csr_matrix((np.round(rng.uniform(0.1, 10, size=len(rows)), 2), (rows, columns)), shape=(num_components, num_machines))
+
+    components_prices = rng.integers(2, 300, size=num_components)
+    products_cost = gozinto.T @ components_prices
+    products_selling_price = dict(zip(products, np.round(products_cost * rng.uniform(1.2, 1.8, size=num_products)).astype(int).tolist()))
+    weekly_time = processing_time.T @ (gozinto @ np.full(num_products, 100))
+    machine_daily_time = dict(zip(machines, np.ceil(weekly_time / 7 * rng.uniform(0.4, 1.2, size=num_machines)).astype(int).tolist()))
+
+    values = sp.hstack([processing_time, gozinto, sp.csr_matrix(components_prices.reshape(-1, 1))], format='csr')
+    # from_spmatrix fills the missing entries with NaN, the data of the model needs them to be 0
+    df = pd.DataFrame.sparse.from_spmatrix(values, index=components, columns=machines + products + ['price']).astype(pd.SparseDtype(float, 0))
+    return df, products_selling_price, machine_daily_time
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate the data of the ATO problem')
+    parser.add_argument('--sparse-synthetic', action='store_true', help='generate a large sparse synthetic instance instead of the laptop data')
+    parser.add_argument('--components', type=int, default=10000)
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--machines', type=int, default=50)
+    parser.add_argument('--density', type=float, default=0.02, help='fraction of the components used by each product')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, default=None, help="folder of the csv files (default 'data/', 'synthetic/data/' for the synthetic instance)")
+    args = parser.parse_args()
+
+    if args.sparse_synthetic:
+        output = args.output if args.output is not None else 'synthetic/data/'
+        os.makedirs(output, exist_ok=True)
+        df, products_selling_price, machine_daily_time = generate_sparse_instance(args.components, args.products, args.machines, args.density, seed=args.seed)
+        write_instance(df, products_selling_price, machine_daily_time, output)
+    else:
+        df = pd.DataFrame.from_dict(processing_times, orient='index', columns=machines)
+        df = pd.concat([df, data], axis=1)
+        df['price'] = df.index.map(components_prices)
+        write_instance(df, products_selling_price, machine_daily_time, args.output if args.output is not None else file_path)
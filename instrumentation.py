@@ -0,0 +1,111 @@
+import csv
+import json
+import time
+from model import GRB # type: ignore
+
+# Columns of the records, in the order of the csv file (the trajectory is only written in the json file)
+FIELDS = ['sweep', 'seed', 'n_scenarios', 'backend', 'from_cache', 'status', 'objVal', 'obj_bound', 'mip_gap',
+          'build_time', 'runtime', 'node_count', 'iter_count', 'time']
+
+class SolveRecorder:
+    #
+    # This class records, for every solve of the ATO model, the time spent to build the model, the runtime of the solver,
+    # the number of branch-and-bound nodes and of simplex iterations, the final MIP gap and the status.
+    # With trajectory=True every solve with gurobi is run with a callback that stores the trajectory of the
+    # incumbent and of the bound as (time, incumbent, bound) every time one of them changes.
+    # The records are dictionaries with the keys of FIELDS (plus 'trajectory'), they are aggregated with aggregate
+    # and written with to_json and to_csv.
+    #
+    # INPUTS:
+    # trajectory: if True the incumbent / bound trajectory of the gurobi solves is recorded
+    # context: dictionary added to every record (e.g. {'sweep': 'in_sample'})
+    #
+    # ATTRIBUTES:
+    # records: list of the records
+    #
+    def __init__(self, trajectory:bool = True, context:dict = None):
+        self.trajectory = trajectory
+        self.context = {} if context is None else dict(context)
+        self.records = []
+
+    def child(self, **context):
+        # Returns a SolveRecorder that adds its records to the same list with some more context
+        recorder = SolveRecorder(self.trajectory, {**self.context, **context})
+        recorder.records = self.records
+        return recorder
+
+    def optimize(self, model, **info):
+        # Optimizes the gurobi model (with the trajectory callback if needed) and records the solve
+        if self.trajectory:
+            model._trajectory = []
+            model.optimize(_trajectory_callback)
+        else:
+            model.optimize()
+        self.record(model, **info)
+
+    def record(self, model, **info):
+        # Records the last solve of the gurobi model, info is added to the record (e.g. n_scenarios)
+        is_mip = model.IsMIP == 1
+        has_solution = model.SolCount > 0
+        self.add({
+            'backend': 'gurobi',
+            'from_cache': False,
+            'status': model.status,
+            'objVal': model.ObjVal if has_solution else None,
+            'obj_bound': model.ObjBound if is_mip and model.status != GRB.INFEASIBLE else None,
+            'mip_gap': model.MIPGap if is_mip and has_solution else None,
+            'build_time': getattr(model, '_build_time', None),
+            'runtime': model.Runtime,
+            'node_count': model.NodeCount if is_mip else None,
+            'iter_count': model.IterCount,
+            'trajectory': getattr(model, '_trajectory', None),
+            **info,
+        })
+
+    def add(self, record:dict):
+        # Adds a record built outside the recorder (e.g. by another backend or by a worker process)
+        self.records.append({'time': time.time(), **self.context, **record})
+
+    def extend(self, records:list):
+        # Adds records that already have their context (e.g. the ones of a SolveRecorder of a worker process)
+        self.records.extend(records)
+
+    def aggregate(self, key:str = 'sweep'):
+        #
+        # OUTPUT:
+        # dictionary with, for every value of key, the number of solves and of cache hits,
+        # the total build time, runtime, nodes and iterations, the maximum MIP gap and the number of solves of every status
+        #
+        summary = {}
+        for record in self.records:
+            group = summary.setdefault(record.get(key), {'solves': 0, 'cache_hits': 0, 'build_time': 0.0, 'runtime': 0.0,
+                                                         'node_count': 0, 'iter_count': 0, 'max_mip_gap': None, 'status': {}})
+            group['solves'] += 1
+            group['cache_hits'] += bool(record.get('from_cache'))
+            for field in ('build_time', 'runtime', 'node_count', 'iter_count'):
+                group[field] += record.get(field) or 0
+            if record.get('mip_gap') is not None:
+                group['max_mip_gap'] = max(group['max_mip_gap'] or 0.0, record['mip_gap'])
+            group['status'][record.get('status')] = group['status'].get(record.get('status'), 0) + 1
+        return summary
+
+    def to_json(self, path:str):
+        # Writes the records (with their trajectories) and their aggregation by sweep in a json file
+        with open(path, 'w') as f:
+            json.dump({'records': self.records, 'sweeps': {str(sweep): group for sweep, group in self.aggregate().items()}}, f, indent=2, default=float)
+
+    def to_csv(self, path:str):
+        # Writes one row for every record with the columns of FIELDS (and the other keys of the context)
+        columns = FIELDS + sorted({key for record in self.records for key in record} - set(FIELDS) - {'trajectory'})
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(self.records)
+
+def _trajectory_callback(model, where):
+    # Appends (time, incumbent, bound) to model._trajectory every time the incumbent or the bound of the MIP changes
+    if where != GRB.Callback.MIP:
+        return
+    point = (model.cbGet(GRB.Callback.RUNTIME), model.cbGet(GRB.Callback.MIP_OBJBST), model.cbGet(GRB.Callback.MIP_OBJBND))
+    if not model._trajectory or model._trajectory[-1][1:] != point[1:]:
+        model._trajectory.append(point)
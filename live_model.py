@@ -0,0 +1,207 @@
+import time
+import pandas as pd # type: ignore
+import numpy as np # type: ignore
+import scipy.sparse as sp # type: ignore
+from model import gp, GRB, get_data, get_model_arrays, get_scenarios, set_parameters # type: ignore
+
+class LiveModel:
+    #
+    # This class keeps a gurobi model of the ATO problem in sync with the data files without rebuilding it:
+    # reload() reads the csv files again, compares them with the data of the model and applies only the differences
+    # - costs of the components and prices of the products: objective coefficients of x and y
+    # - daily time of the machines: right hand side of the working_hours constraints
+    # - processing times and gozinto factors: coefficients of the working_hours and gozinto constraints
+    # - components, products or machines added or removed: their variables and constraints are added or removed
+    # and then optimize() solves the model again starting from the previous solution.
+    # The model is the one of build_model_variables with the demand written as upper bound of y and without
+    # the grouping of the gozinto constraints (a change of a gozinto factor would change the groups).
+    #
+    # INPUTS:
+    # path: path to the data files, as in get_data
+    # demand, prob: demand scenarios and their probabilities, as in gurobi_model_variables
+    # threads, time_limit, mip_gap: as in gurobi_model_variables
+    #
+    # ATTRIBUTES:
+    # model: gurobi model
+    # x: dictionary with the Var of each component
+    # y: dictionary with the list of the Var of each product (one for each scenario)
+    # working_hours: dictionary with the Constr of each machine
+    # gozinto: dictionary with the list of the Constr of each component (one for each scenario)
+    # df1, products_price, machine_daily_time: data of the model
+    # build_time: time in seconds spent to build the model
+    #
+    def __init__(self, path:str = None, demand:list = None, prob:list = None, threads:int = None, time_limit:float = None, mip_gap:float = None):
+        start_time = time.perf_counter()
+        self.path = path
+        df1, products_price, machine_daily_time, products, num_components, num_items, num_machines = get_data(path = path)
+        processing_time, gozinto, cost, price, machine_time = get_model_arrays(df1, products_price, machine_daily_time, sparse = True)
+        demand, self.prob = get_scenarios(demand, prob, num_items)
+        num_scenarios = len(demand)
+
+        self.model = gp.Model("ato")
+        self.model.setParam('OutputFlag', 0)
+        set_parameters(self.model, threads, time_limit, mip_gap)
+        x = self.model.addMVar(num_components, vtype=GRB.INTEGER, obj=-cost, name="x")
+        y = self.model.addMVar((num_items, num_scenarios), vtype=GRB.INTEGER, ub=demand.T, obj=np.outer(price, self.prob), name="y")
+        self.model.ModelSense = GRB.MAXIMIZE
+        working_hours = self.model.addMConstr(processing_time.T, x, '<', machine_time*7, name="working_hours")
+        # row i*n_scenarios + s is sum_j gozinto[i, j] * y[j, s] - x[i] <= 0
+        gozinto_matrix = sp.hstack([
+            sp.kron(gozinto, sp.identity(num_scenarios)),
+            -sp.kron(sp.identity(num_components), np.ones((num_scenarios, 1)))
+        ], format='csr')
+        gozinto_rows = self.model.addMConstr(gozinto_matrix, y.reshape(-1).tolist() + x.tolist(), '<', np.zeros(num_components*num_scenarios), name="gozinto").tolist()
+        self.model.update()
+
+        self.x = dict(zip(df1.index, x.tolist()))
+        self.y = dict(zip(products_price, y.tolist()))
+        self.demand = dict(zip(products_price, demand.T))
+        self.working_hours = dict(zip(machine_daily_time, working_hours.tolist()))
+        self.gozinto = {component: gozinto_rows[i*num_scenarios:(i + 1)*num_scenarios] for i, component in enumerate(df1.index)}
+        self.df1, self.products_price, self.machine_daily_time = df1, products_price, machine_daily_time
+        self.solution = None
+        self.build_time = time.perf_counter() - start_time
+
+    @property
+    def num_scenarios(self):
+        return len(self.prob)
+
+    @property
+    def objVal(self):
+        return self.model.ObjVal
+
+    @property
+    def status(self):
+        return self.model.status
+
+    def reload(self, demand:dict = None):
+        # Reads the data files again and applies the differences to the model (see apply)
+        df1, products_price, machine_daily_time, products, num_components, num_items, num_machines = get_data(path = self.path, reload = True)
+        return self.apply(df1, products_price, machine_daily_time, demand)
+
+    def apply(self, df1:pd.DataFrame, products_price:dict, machine_daily_time:dict, demand:dict = None):
+        #
+        # This function changes the model from its data to the given data, touching only what is different
+        #
+        # INPUTS:
+        # df1, products_price, machine_daily_time: new data, as in gurobi_model_variables
+        # demand: dictionary with the demand (array (n_scenarios,)) of every new product, needed only when products are added
+        #
+        # OUTPUT:
+        # changes: dictionary with the number of changed objective coefficients, right hand sides and constraint coefficients
+        #   and the lists of the added and removed components, products and machines
+        #
+        old_machines, new_machines = list(self.machine_daily_time), list(machine_daily_time)
+        old_products, new_products = list(self.products_price), list(products_price)
+        changes = {
+            'objective': 0, 'rhs': 0, 'coefficients': 0,
+            'removed_components': [c for c in self.df1.index if c not in df1.index],
+            'added_components': [c for c in df1.index if c not in self.df1.index],
+            'removed_products': [p for p in old_products if p not in products_price],
+            'added_products': [p for p in new_products if p not in self.products_price],
+            'removed_machines': [m for m in old_machines if m not in machine_daily_time],
+            'added_machines': [m for m in new_machines if m not in self.machine_daily_time],
+        }
+        missing = [p for p in changes['added_products'] if demand is None or p not in demand]
+        if missing:
+            raise ValueError(f"The demand of the new products {missing} is needed to add them to the model")
+        components = [c for c in df1.index if c in self.df1.index]
+        products = [p for p in new_products if p in self.products_price]
+        machines = [m for m in new_machines if m in self.machine_daily_time]
+
+        # Removed components, products and machines
+        for component in changes['removed_components']:
+            self.model.remove([self.x.pop(component)] + self.gozinto.pop(component))
+        for product in changes['removed_products']:
+            self.model.remove(self.y.pop(product))
+            del self.demand[product]
+        for machine in changes['removed_machines']:
+            self.model.remove(self.working_hours.pop(machine))
+
+        # New products, machines (with the processing times of the components already in the model) and components
+        for product in changes['added_products']:
+            self.demand[product] = np.asarray(demand[product], dtype=float)
+            self.y[product] = self.model.addMVar(self.num_scenarios, vtype=GRB.INTEGER, ub=self.demand[product], obj=products_price[product]*self.prob, name=f"y_{product}").tolist()
+        for machine in changes['added_machines']:
+            times = df1.loc[components, machine].to_numpy(dtype=float)
+            self.working_hours[machine] = self.model.addLConstr(gp.LinExpr(times, [self.x[c] for c in components]), '<', machine_daily_time[machine]*7, name=f"working_hours_{machine}")
+        for component in changes['added_components']:
+            self.x[component] = self.model.addVar(vtype=GRB.INTEGER, obj=-df1.at[component, df1.columns[-1]], name=f"x_{component}")
+        self.model.update()
+        # gozinto factors of the new products in the components already in the model
+        for product in changes['added_products']:
+            for component in components:
+                if df1.at[component, product] != 0:
+                    self._set_gozinto(component, product, df1.at[component, product])
+        # rows of the new components, written with all the products and machines
+        for component in changes['added_components']:
+            for machine in new_machines:
+                if df1.at[component, machine] != 0:
+                    self.model.chgCoeff(self.working_hours[machine], self.x[component], df1.at[component, machine])
+            factors = df1.loc[component, new_products].to_numpy(dtype=float)
+            used = [(factor, product) for factor, product in zip(factors, new_products) if factor != 0]
+            self.gozinto[component] = [
+                self.model.addLConstr(gp.LinExpr([factor for factor, product in used] + [-1.0], [self.y[product][s] for factor, product in used] + [self.x[component]]), '<', 0, name=f"gozinto_{component}_{s}")
+                for s in range(self.num_scenarios)]
+
+        # Changes of the components, products and machines in both the data
+        old_cost = self.df1.loc[components, self.df1.columns[-1]].to_numpy(dtype=float)
+        new_cost = df1.loc[components, df1.columns[-1]].to_numpy(dtype=float)
+        for k in np.flatnonzero(old_cost != new_cost):
+            self.x[components[k]].Obj = -new_cost[k]
+            changes['objective'] += 1
+        for product in products:
+            if products_price[product] != self.products_price[product]:
+                self.model.setAttr('Obj', self.y[product], (products_price[product]*self.prob).tolist())
+                changes['objective'] += self.num_scenarios
+        for machine in machines:
+            if machine_daily_time[machine] != self.machine_daily_time[machine]:
+                self.working_hours[machine].RHS = machine_daily_time[machine]*7
+                changes['rhs'] += 1
+        old_times = self.df1.loc[components, machines].to_numpy(dtype=float)
+        new_times = df1.loc[components, machines].to_numpy(dtype=float)
+        for i, m in zip(*np.nonzero(old_times != new_times)):
+            self.model.chgCoeff(self.working_hours[machines[m]], self.x[components[i]], new_times[i, m])
+            changes['coefficients'] += 1
+        old_factors = self.df1.loc[components, products].to_numpy(dtype=float)
+        new_factors = df1.loc[components, products].to_numpy(dtype=float)
+        for i, j in zip(*np.nonzero(old_factors != new_factors)):
+            self._set_gozinto(components[i], products[j], new_factors[i, j])
+            changes['coefficients'] += self.num_scenarios
+
+        self.df1, self.products_price, self.machine_daily_time = df1, dict(products_price), dict(machine_daily_time)
+        return changes
+
+    def optimize(self, recorder = None):
+        # Optimizes the model, warm-started with the previous solution (0 for the new variables)
+        x_vars, y_vars = list(self.x.values()), [var for product in self.y.values() for var in product]
+        if self.solution is not None:
+            x_value, y_value = self.solution
+            self.model.setAttr('Start', x_vars, [x_value.get(component, 0.0) for component in self.x])
+            self.model.setAttr('Start', y_vars, np.concatenate([y_value.get(product, np.zeros(self.num_scenarios)) for product in self.y]).tolist())
+        if recorder is None:
+            self.model.optimize()
+        else:
+            recorder.optimize(self.model, n_scenarios = self.num_scenarios)
+        if self.model.SolCount > 0:
+            x_value = dict(zip(self.x, self.model.getAttr('X', x_vars)))
+            y_value = dict(zip(self.y, np.reshape(self.model.getAttr('X', y_vars), (len(self.y), self.num_scenarios))))
+            self.solution = (x_value, y_value)
+
+    def _set_gozinto(self, component, product, factor:float):
+        # Writes the gozinto factor of the component in the product in the gozinto rows of all the scenarios
+        for s in range(self.num_scenarios):
+            self.model.chgCoeff(self.gozinto[component][s], self.y[product][s], factor)
+
+if __name__ == '__main__':
+    # Solves the model of the data in the 'data' folder and then, every time enter is pressed,
+    # applies the changes of the csv files and solves it again
+    live = LiveModel()
+    live.optimize()
+    print(f'Model built in {live.build_time:.3f} s, objective value {live.objVal}')
+    while input('Press enter to reload the data (q to quit) ') != 'q':
+        start_time = time.perf_counter()
+        changes = live.reload()
+        live.optimize()
+        print(changes)
+        print(f'Updated and solved in {time.perf_counter() - start_time:.3f} s, objective value {live.objVal}')
@@ -0,0 +1,8 @@
+import sys
+from model import compile_data # type: ignore
+
+# Converts the csv files of the data folder in the compiled format read by model.get_data
+# usage: python main_compile_data.py [path to the folder containing 'data/']
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else None
+    compile_data(path = path)
@@ -1,12 +1,51 @@
-import gurobipy as gp # type: ignore
-import pandas as pd # type: ignore
-from gurobipy import GRB # type: ignore
-import numpy as np # type: ignore
-from model import gurobi_model # type: ignore
-from scipy.stats import norm # type: ignore
-import matplotlib.pyplot as plt # type: ignore
+from __future__ import annotations
+import argparse
+import functools
+import math
+import os
+from statistics import NormalDist
+from typing import TYPE_CHECKING
 
-def compute_in_sample_stability(starting_n_scenario:int = 2, max_iterations:int=50, step_iteration:int = 1, alpha:float = 0.008, df1:pd.DataFrame = None, products_price:dict = None, machine_daily_time:dict = None):
+# The modules of the model (gurobipy, pandas, scipy) and matplotlib are imported only by the functions that use them,
+# so that importing this module (e.g. for compute_in_sample_stability) does not load them and has no side effects
+if TYPE_CHECKING:
+    import pandas as pd # type: ignore
+    from concurrent.futures import ProcessPoolExecutor
+    from scenarios import ScenarioGenerator # type: ignore
+    from instrumentation import SolveRecorder # type: ignore
+
+# SolveCache of each cache_path opened by this process (one connection for the whole analysis, or for the life of a worker process)
+_open_caches = {}
+
+def _get_cache(path:str):
+    # Returns the SolveCache of path opened by this process, opening it the first time
+    cache = _open_caches.get(path)
+    if cache is None:
+        from multiprocessing import util
+        from solve_cache import SolveCache # type: ignore
+        if not _open_caches:
+            # the worker processes of the pool are stopped without the atexit handlers, but with the multiprocessing finalizers
+            util.Finalize(None, _close_caches, exitpriority=10)
+        cache = _open_caches[path] = SolveCache(path)
+    return cache
+
+def _close_caches():
+    # Closes the SolveCache opened by this process
+    while _open_caches:
+        _open_caches.popitem()[1].close()
+
+def _closing_caches(analysis):
+    # Closes the SolveCache opened by the stability analysis when it returns (or raises)
+    @functools.wraps(analysis)
+    def wrapper(*args, **kwargs):
+        try:
+            return analysis(*args, **kwargs)
+        finally:
+            _close_caches()
+    return wrapper
+
+@_closing_caches
+def compute_in_sample_stability(starting_n_scenario:int = 2, max_iterations:int=50, step_iteration:int = 1, alpha:float = 0.008, df1:pd.DataFrame = None, products_price:dict = None, machine_daily_time:dict = None, incremental:bool = False, n_workers:int = 1, threads_per_worker:int = None, cache_path:str = None, early_stop:bool = False, sweep:str = 'linear', generator:ScenarioGenerator = None, backend:str = 'gurobi', recorder:SolveRecorder = None, time_limit:float = None, mip_gap:float = None, accept_gap:float = None, relaxation:str = None, mip_check_every:int = 10):
     #
     # This function computes the in-sample stability analysis for the ATO problem with stochastic demand
     #
@@ -22,64 +61,143 @@ def compute_in_sample_stability(starting_n_scenario:int = 2, max_iterations:int=
     #   The last column is the fixed cost of each component.
     # products_price: dictionary with the price of each product
     # machine_daily_time: dictionary with the daily time in minutes available for each machine
+    # incremental: if True the models of S1 and S2 are not rebuilt at every iteration: they are kept as ScenarioModel
+    #   and only the new step_iteration scenarios are added, warm-starting from the previous solution.
+    #   ATTENTION: in this case the samples are nested, every sample contains the one of the previous iteration
+    # n_workers: number of worker processes; when > 1 (and incremental is False) the solves of the different iterations are sent to a process pool.
+    #   The result is the same stability_diff_dict of the serial run with the same threads_per_worker
+    # threads_per_worker: value of the gurobi parameter Threads used for every solve (None for the gurobi default)
+    # cache_path: path of the SolveCache file where the solutions of the sampled models are stored and read, None to always solve them
+    # early_stop: if True the iterations stop as soon as the CLT conditions are satisfied
+    # sweep: 'linear' increases the number of scenarios by step_iteration at every iteration,
+    #   'adaptive' doubles it until the CLT conditions are satisfied and then bisects between the last two numbers
+    #   of scenarios, stopping as soon as the smallest one is found (incremental and n_workers are ignored).
+    #   The doubling never goes beyond the last number of scenarios of the linear sweep
+    # generator: ScenarioGenerator of the demand, every sample is one of its independent streams.
+    #   If None the demand is normal(100, 40) sampled with np.random.RandomState as in the first version of the project
+    # backend: solver of the sampled models, 'gurobi' or 'highs' (see backends.solve_problem).
+    #   The incremental models need gurobi
+    # recorder: SolveRecorder where the statistics of every solve are recorded with sweep = 'in_sample'
+    #   (the seed of the sample and the number of scenarios are in the records), None to record nothing
+    # time_limit, mip_gap: TimeLimit and MIPGap of every solve (None for no limit and the default gap)
+    # accept_gap: if not None the solves stopped before optimality (e.g. by time_limit) whose incumbent is within this
+    #   relative gap from the bound are used in the analysis, otherwise they make the model 'not feasible'
+    # relaxation: None to solve the integer programs, 'lp' or 'round' to solve their LP relaxation (rounded with 'round'),
+    #   see gurobi_model_variables (only with the 'gurobi' backend and not incremental)
+    # mip_check_every: with relaxation, every mip_check_every iterations the integer program of S1 is also solved
+    #   and the relative difference of the objective values (integrality gap) is measured, 0 to never do it
     #
     # OUTPUT:
     # n_scenario: when the CLT conditions are satisfied number of scenarios 
     #   otherwise 'No scenario satisfies the CLT conditions' or
     #   'Model not feasible' if the model is not feasible
     # stability_diff_dict: dictionary with the stability difference for each number of scenarios
+    # integrality_gap_dict: only with relaxation, dictionary with the integrality gap of S1 for the checked numbers of scenarios
     #  
+    from concurrent.futures import ProcessPoolExecutor
+    from model import ScenarioModel, get_data, set_parameters # type: ignore
+    from scenarios import scenario_stream # type: ignore
+    from instrumentation import SolveRecorder # type: ignore
 
-
-    if products_price == None:
-        num_items = 2
+    if sweep not in ('linear', 'adaptive'):
+        raise ValueError(f"Unknown sweep '{sweep}', it must be 'linear' or 'adaptive'")
+    if products_price is None:
+        df1, products_price, machine_daily_time, products, num_components, num_items, num_machines = get_data()
     else:
         num_items = len(products_price)
+    if backend != 'gurobi' and incremental:
+        raise ValueError("The incremental models need the 'gurobi' backend")
+    if relaxation is not None and (backend != 'gurobi' or incremental):
+        raise ValueError("The relaxation needs the 'gurobi' backend and is not available for the incremental models")
+    if recorder is not None:
+        recorder = recorder.child(sweep='in_sample')
     n_scenario = starting_n_scenario
     final_scenario = 'No scenario satisfies the CLT conditions'
 
     stability_diff_dict = {}
+    integrality_gap_dict = {}
+    stats = RunningStats()
+    z_alpha = NormalDist().inv_cdf(1 - alpha / 2)
+    if sweep == 'adaptive':
+        def probe(iteration, n_scenario):
+            objVal_S1, x_S1 = _solve_sampled_model(42*iteration, n_scenario, num_items, df1=df1, products_price=products_price, machine_daily_time=machine_daily_time, threads=threads_per_worker, cache_path=cache_path, generator=generator, backend=backend, recorder=recorder, time_limit=time_limit, mip_gap=mip_gap, accept_gap=accept_gap, relaxation=relaxation)
+            objVal_S2, x_S2 = _solve_sampled_model(84*iteration+1, n_scenario, num_items, df1=df1, products_price=products_price, machine_daily_time=machine_daily_time, threads=threads_per_worker, cache_path=cache_path, generator=generator, backend=backend, recorder=recorder, time_limit=time_limit, mip_gap=mip_gap, accept_gap=accept_gap, relaxation=relaxation)
+            if objVal_S1 is None or objVal_S2 is None:
+                return None
+            if relaxation is not None and mip_check_every and iteration % mip_check_every == 0:
+                integrality_gap_dict[n_scenario] = _integrality_gap(objVal_S1, 42*iteration, n_scenario, num_items, df1=df1, products_price=products_price, machine_daily_time=machine_daily_time, threads=threads_per_worker, cache_path=cache_path, generator=generator, recorder=recorder, time_limit=time_limit, mip_gap=mip_gap, accept_gap=accept_gap)
+            return abs(objVal_S1 - objVal_S2)
+        max_n_scenario = starting_n_scenario + step_iteration*(max_iterations - 1)
+        return _with_integrality_gaps(_adaptive_sweep(probe, starting_n_scenario, step_iteration, max_iterations, z_alpha, max_n_scenario), relaxation, integrality_gap_dict)
+    if incremental:
+        modelS1 = ScenarioModel(df1=df1, products_price=products_price, machine_daily_time=machine_daily_time)
+        modelS2 = ScenarioModel(df1=df1, products_price=products_price, machine_daily_time=machine_daily_time)
+        for model in (modelS1, modelS2):
+            set_parameters(model.model, threads_per_worker, time_limit, mip_gap)
+        stream_S1 = scenario_stream(generator, 42, num_items)
+        stream_S2 = scenario_stream(generator, 1, num_items)
+    elif n_workers > 1:
+        executor = ProcessPoolExecutor(max_workers=n_workers)
+        data = dict(df1=df1, products_price=products_price, machine_daily_time=machine_daily_time, threads=threads_per_worker, cache_path=cache_path, generator=generator, backend=backend,
+                    time_limit=time_limit, mip_gap=mip_gap, accept_gap=accept_gap, relaxation=relaxation,
+                    recorder=None if recorder is None else SolveRecorder(recorder.trajectory, recorder.context))
+        # Submit every iteration assuming the number of scenarios grows by step_iteration at each of them
+        pending = [_submit_iteration(executor, [42*iteration, 84*iteration+1], n_scenario + step_iteration*iteration, num_items, data) for iteration in range(max_iterations)]
     for iteration in range(max_iterations):
-        # Generate two independent sets of scenarios S1 and S2 with cardinality n_scenario
-        np.random.seed(42*iteration)
-        demand_S1 =  np.random.normal(loc=100, scale=40, size=(n_scenario, num_items)).astype(int)
-        demand_S1 = np.clip(demand_S1, 0, None) # Check no values are negative
-
-        np.random.seed(84*iteration+1)
-        demand_S2 = np.random.normal(loc=100, scale=40, size=(n_scenario, num_items)).astype(int)
-        demand_S2 = np.clip(demand_S2, 0, None)
-
-        # Solve the stochastic models for S1 and S2
-        modelS1 = gurobi_model(df1=df1, products_price=products_price, machine_daily_time=machine_daily_time, demand=demand_S1)
-        modelS2 = gurobi_model(df1=df1, products_price=products_price, machine_daily_time=machine_daily_time, demand=demand_S2)
+        if incremental:
+            # Extend the two independent sets of scenarios S1 and S2 up to cardinality n_scenario
+            demand_S1 = stream_S1.sample(n_scenario - modelS1.num_scenarios)
+            demand_S2 = stream_S2.sample(n_scenario - modelS2.num_scenarios)
+
+            modelS1.add_scenarios(demand_S1)
+            modelS2.add_scenarios(demand_S2)
+            objVal_S1 = modelS1.objVal if modelS1.optimize(recorder, accept_gap, seed=42) else None
+            objVal_S2 = modelS2.objVal if modelS2.optimize(recorder, accept_gap, seed=1) else None
+        elif n_workers > 1:
+            if pending[iteration][0] != n_scenario:
+                # The sweep stopped growing: resubmit the remaining iterations with the right number of scenarios
+                for it in range(iteration, max_iterations):
+                    for future in pending[it][1]:
+                        future.cancel()
+                    pending[it] = _submit_iteration(executor, [42*it, 84*it+1], n_scenario + step_iteration*(it-iteration), num_items, data)
+            (objVal_S1, x_S1), (objVal_S2, x_S2) = [_collect(future, recorder) for future in pending[iteration][1]]
+        else:
+            # Solve the stochastic models for two independent sets of scenarios S1 and S2 with cardinality n_scenario
+            objVal_S1, x_S1 = _solve_sampled_model(42*iteration, n_scenario, num_items, df1=df1, products_price=products_price, machine_daily_time=machine_daily_time, threads=threads_per_worker, cache_path=cache_path, generator=generator, backend=backend, recorder=recorder, time_limit=time_limit, mip_gap=mip_gap, accept_gap=accept_gap, relaxation=relaxation)
+            objVal_S2, x_S2 = _solve_sampled_model(84*iteration+1, n_scenario, num_items, df1=df1, products_price=products_price, machine_daily_time=machine_daily_time, threads=threads_per_worker, cache_path=cache_path, generator=generator, backend=backend, recorder=recorder, time_limit=time_limit, mip_gap=mip_gap, accept_gap=accept_gap, relaxation=relaxation)
         
-        if modelS1 is None or modelS2 is None:
-            return ('Model not feasible', stability_diff_dict)
+        if objVal_S1 is None or objVal_S2 is None:
+            if n_workers > 1 and not incremental:
+                executor.shutdown(wait=False, cancel_futures=True)
+            return _with_integrality_gaps(('Model not feasible', stability_diff_dict), relaxation, integrality_gap_dict)
+        if relaxation is not None and mip_check_every and iteration % mip_check_every == 0:
+            # Error of the relaxation measured against the integer program of S1
+            integrality_gap_dict[n_scenario] = _integrality_gap(objVal_S1, 42*iteration, n_scenario, num_items, df1=df1, products_price=products_price, machine_daily_time=machine_daily_time, threads=threads_per_worker, cache_path=cache_path, generator=generator, recorder=recorder, time_limit=time_limit, mip_gap=mip_gap, accept_gap=accept_gap)
         # Compute the stability difference
-        stability_diff = abs(modelS1.objVal - modelS2.objVal)
+        stability_diff = abs(objVal_S1 - objVal_S2)
         stability_diff_dict[n_scenario] = stability_diff
+        stats.update(stability_diff)
         
-        # print(f'Mean = {mu}, Standard Deviation = {sigma}, z_alpha = {z_alpha}')
+        # print(f'Mean = {stats.mean}, Standard Deviation = {stats.std}, z_alpha = {z_alpha}')
         if iteration == 0:
             n_scenario += step_iteration
         elif final_scenario == 'No scenario satisfies the CLT conditions':
-            mu = np.mean(list(stability_diff_dict.values()))
-            sigma = np.std(list(stability_diff_dict.values()))
-            z_alpha = norm.ppf(1 - alpha / 2)
-            # print(mu + z_alpha*sigma/np.sqrt(max_iterations), mu - z_alpha*sigma/np.sqrt(max_iterations))
-            
             # Check if the CLT conditions are satisfied
-            if mu + z_alpha*sigma/np.sqrt(iteration+1) > 0 and mu - z_alpha*sigma/np.sqrt(iteration+1) < 0:
+            if stats.clt_satisfied(z_alpha):
                 final_scenario = n_scenario
+                if early_stop:
+                    break
             else:
                 n_scenario += step_iteration
         else:
             n_scenario += step_iteration
-    
 
-    return (final_scenario, stability_diff_dict)
+    if n_workers > 1 and not incremental:
+        executor.shutdown(cancel_futures=True)
+    return _with_integrality_gaps((final_scenario, stability_diff_dict), relaxation, integrality_gap_dict)
 
-def compute_out_sample_stability(starting_n_scenario:int = 2, big_n_scenario:int = 55, max_iterations:int=50, step_iteration:int = 1, alpha:float = 0.025, df1:pd.DataFrame = None, products_price:dict = None, machine_daily_time:dict = None) -> int:
+@_closing_caches
+def compute_out_sample_stability(starting_n_scenario:int = 2, big_n_scenario:int = 55, max_iterations:int=50, step_iteration:int = 1, alpha:float = 0.025, df1:pd.DataFrame = None, products_price:dict = None, machine_daily_time:dict = None, incremental:bool = False, n_workers:int = 1, threads_per_worker:int = None, evaluator:bool = False, n_held_out:int = 100000, cache_path:str = None, early_stop:bool = False, sweep:str = 'linear', generator:ScenarioGenerator = None, backend:str = 'gurobi', recorder:SolveRecorder = None, time_limit:float = None, mip_gap:float = None, accept_gap:float = None, relaxation:str = None, mip_check_every:int = 10) -> int:
     #
     # This function computes the out-of-sample stability analysis for the ATO problem with stochastic demand
     #
@@ -95,138 +213,361 @@ def compute_out_sample_stability(starting_n_scenario:int = 2, big_n_scenario:int
     #   The last column is the fixed cost of each component.
     # products_price: dictionary with the price of each product
     # machine_daily_time: dictionary with the daily time in minutes available for each machine
+    # incremental: if True the model of S1 is not rebuilt at every iteration: it is kept as a ScenarioModel
+    #   and only the new step_iteration scenarios are added, warm-starting from the previous solution.
+    #   ATTENTION: in this case the samples are nested, every sample contains the one of the previous iteration
+    # n_workers: number of worker processes; when > 1 (and incremental is False) the solves of the different iterations are sent to a process pool.
+    #   The result is the same stability_diff_dict of the serial run with the same threads_per_worker
+    # threads_per_worker: value of the gurobi parameter Threads used for every solve (None for the gurobi default)
+    # evaluator: if True the models are not compared through their objective values: the components x of the
+    #   big_n_scenario solution and of every S1 solution are evaluated with evaluate_first_stage on a held-out sample
+    #   of n_held_out scenarios and the stability difference is the difference of their expected profits
+    # n_held_out: number of scenarios of the held-out sample
+    # cache_path: path of the SolveCache file where the solutions of the sampled models are stored and read, None to always solve them
+    # early_stop: if True the iterations stop as soon as the CLT conditions are satisfied
+    # sweep: 'linear' increases the number of scenarios by step_iteration at every iteration,
+    #   'adaptive' doubles it until the CLT conditions are satisfied and then bisects between the last two numbers
+    #   of scenarios, stopping as soon as the smallest one is found (incremental and n_workers are ignored).
+    #   The doubling never goes beyond the last number of scenarios of the linear sweep and big_n_scenario
+    # generator: ScenarioGenerator of the demand, every sample is one of its independent streams.
+    #   If None the demand is normal(100, 40) sampled with np.random.RandomState as in the first version of the project
+    # backend: solver of the sampled models, 'gurobi' or 'highs' (see backends.solve_problem).
+    #   The incremental models and the evaluator need gurobi
+    # recorder: SolveRecorder where the statistics of every solve are recorded with sweep = 'out_sample', None to record nothing
+    # time_limit, mip_gap, accept_gap, relaxation, mip_check_every: as in compute_in_sample_stability
     #
     # OUTPUT:
     # n_scenario: when the CLT conditions are satisfied number of scenarios 
     #   otherwise 'No scenario satisfies the CLT conditions' or
     #   'Model not feasible' if the model is not feasible
     # stability_diff_dict: dictionary with the stability difference for each number of scenarios
+    # integrality_gap_dict: only with relaxation, dictionary with the integrality gap of S1 for the checked numbers of scenarios
     #  
-    
-    if products_price == None:
-        num_items = 2
+    from concurrent.futures import ProcessPoolExecutor
+    from model import ScenarioModel, evaluate_first_stage, get_data, set_parameters # type: ignore
+    from scenarios import scenario_stream # type: ignore
+    from instrumentation import SolveRecorder # type: ignore
+
+    if sweep not in ('linear', 'adaptive'):
+        raise ValueError(f"Unknown sweep '{sweep}', it must be 'linear' or 'adaptive'")
+    if products_price is None:
+        df1, products_price, machine_daily_time, products, num_components, num_items, num_machines = get_data()
     else:
         num_items = len(products_price)
+    if backend != 'gurobi' and (incremental or evaluator):
+        raise ValueError("The incremental models and the evaluator need the 'gurobi' backend")
+    if relaxation is not None and (backend != 'gurobi' or incremental):
+        raise ValueError("The relaxation needs the 'gurobi' backend and is not available for the incremental models")
+    if recorder is not None:
+        recorder = recorder.child(sweep='out_sample')
     n_scenario = starting_n_scenario
     final_scenario = 'No scenario satisfies the CLT conditions'
 
     stability_diff_dict = {}
-    np.random.seed(1)
-    demand_bigN = np.random.normal(loc=100, scale=40, size=(big_n_scenario, num_items)).astype(int)
-    demand_bigN = np.clip(demand_bigN, 0, None)
-    model_bigN = gurobi_model(df1=df1, products_price=products_price, machine_daily_time=machine_daily_time, demand=demand_bigN)
-    objVal_bigN = model_bigN.objVal
+    integrality_gap_dict = {}
+    stats = RunningStats()
+    z_alpha = NormalDist().inv_cdf(1 - alpha / 2)
+    if sweep == 'adaptive':
+        incremental = False
+        n_workers = 1
+    if n_workers > 1 and not incremental:
+        executor = ProcessPoolExecutor(max_workers=n_workers)
+        data = dict(df1=df1, products_price=products_price, machine_daily_time=machine_daily_time, threads=threads_per_worker, cache_path=cache_path, generator=generator, backend=backend,
+                    time_limit=time_limit, mip_gap=mip_gap, accept_gap=accept_gap, relaxation=relaxation,
+                    recorder=None if recorder is None else SolveRecorder(recorder.trajectory, recorder.context))
+        future_bigN = executor.submit(_solve_sampled_model_in_worker, 1, big_n_scenario, num_items, **data)
+        # Submit every iteration assuming the number of scenarios grows by step_iteration at each of them
+        pending = [_submit_iteration(executor, [42*iteration], n_scenario + step_iteration*iteration, num_items, data) for iteration in range(max_iterations)]
+        objVal_bigN, x_bigN = _collect(future_bigN, recorder)
+    else:
+        objVal_bigN, x_bigN = _solve_sampled_model(1, big_n_scenario, num_items, df1=df1, products_price=products_price, machine_daily_time=machine_daily_time, threads=threads_per_worker, cache_path=cache_path, generator=generator, backend=backend, recorder=recorder, time_limit=time_limit, mip_gap=mip_gap, accept_gap=accept_gap, relaxation=relaxation)
+    if objVal_bigN is None:
+        if n_workers > 1 and not incremental:
+            executor.shutdown(wait=False, cancel_futures=True)
+        return _with_integrality_gaps(('Model not feasible', stability_diff_dict), relaxation, integrality_gap_dict)
+    if evaluator:
+        # Held-out sample on which the components of every solution are evaluated
+        # with a generator it is streamed in batches at every evaluation instead of being kept in memory
+        if generator is None:
+            demand_held_out = scenario_stream(None, 2, num_items).sample(n_held_out)
+            held_out = lambda: demand_held_out
+        else:
+            held_out = lambda: generator.stream(2).batches(n_held_out)
+        objVal_bigN, revenue = evaluate_first_stage(x_bigN, held_out(), df1=df1, products_price=products_price, machine_daily_time=machine_daily_time)
+    if sweep == 'adaptive':
+        def probe(iteration, n_scenario):
+            objVal_S1, x_S1 = _solve_sampled_model(42*iteration, n_scenario, num_items, df1=df1, products_price=products_price, machine_daily_time=machine_daily_time, threads=threads_per_worker, cache_path=cache_path, generator=generator, backend=backend, recorder=recorder, time_limit=time_limit, mip_gap=mip_gap, accept_gap=accept_gap, relaxation=relaxation)
+            if objVal_S1 is None:
+                return None
+            if relaxation is not None and mip_check_every and iteration % mip_check_every == 0:
+                integrality_gap_dict[n_scenario] = _integrality_gap(objVal_S1, 42*iteration, n_scenario, num_items, df1=df1, products_price=products_price, machine_daily_time=machine_daily_time, threads=threads_per_worker, cache_path=cache_path, generator=generator, recorder=recorder, time_limit=time_limit, mip_gap=mip_gap, accept_gap=accept_gap)
+            if evaluator:
+                objVal_S1, revenue = evaluate_first_stage(x_S1, held_out(), df1=df1, products_price=products_price, machine_daily_time=machine_daily_time)
+            return abs(objVal_S1 - objVal_bigN)
+        # the samples are compared with the big_n_scenario one, larger samples are not meaningful
+        max_n_scenario = min(starting_n_scenario + step_iteration*(max_iterations - 1), big_n_scenario)
+        return _with_integrality_gaps(_adaptive_sweep(probe, starting_n_scenario, step_iteration, max_iterations, z_alpha, max_n_scenario), relaxation, integrality_gap_dict)
+    if incremental:
+        modelS1 = ScenarioModel(df1=df1, products_price=products_price, machine_daily_time=machine_daily_time)
+        set_parameters(modelS1.model, threads_per_worker, time_limit, mip_gap)
+        stream_S1 = scenario_stream(generator, 42, num_items)
     for iteration in range(max_iterations):
-        # Generate scenario S1 with cardinality n_scenario
-        np.random.seed(42*iteration)
-        demand_S1 = np.random.normal(loc=100, scale=40, size=(n_scenario, num_items)).astype(int)
-        demand_S1 = np.clip(demand_S1, 0, None)
+        if incremental:
+            # Extend scenario S1 up to cardinality n_scenario
+            demand_S1 = stream_S1.sample(n_scenario - modelS1.num_scenarios)
 
-        # Solve the stochastic model for S1
-        modelS1 = gurobi_model(df1=df1, products_price=products_price, machine_daily_time=machine_daily_time, demand=demand_S1)
+            modelS1.add_scenarios(demand_S1)
+            objVal_S1 = modelS1.objVal if modelS1.optimize(recorder, accept_gap, seed=42) else None
+            x_S1 = modelS1.x.X if objVal_S1 is not None else None
+        elif n_workers > 1:
+            if pending[iteration][0] != n_scenario:
+                # The sweep stopped growing: resubmit the remaining iterations with the right number of scenarios
+                for it in range(iteration, max_iterations):
+                    for future in pending[it][1]:
+                        future.cancel()
+                    pending[it] = _submit_iteration(executor, [42*it], n_scenario + step_iteration*(it-iteration), num_items, data)
+            objVal_S1, x_S1 = _collect(pending[iteration][1][0], recorder)
+        else:
+            # Solve the stochastic model for a scenario S1 with cardinality n_scenario
+            objVal_S1, x_S1 = _solve_sampled_model(42*iteration, n_scenario, num_items, df1=df1, products_price=products_price, machine_daily_time=machine_daily_time, threads=threads_per_worker, cache_path=cache_path, generator=generator, backend=backend, recorder=recorder, time_limit=time_limit, mip_gap=mip_gap, accept_gap=accept_gap, relaxation=relaxation)
         
-        if modelS1 is None:
-            return ('Model not feasible', stability_diff_dict)
+        if objVal_S1 is None:
+            if n_workers > 1 and not incremental:
+                executor.shutdown(wait=False, cancel_futures=True)
+            return _with_integrality_gaps(('Model not feasible', stability_diff_dict), relaxation, integrality_gap_dict)
+        if relaxation is not None and mip_check_every and iteration % mip_check_every == 0:
+            # Error of the relaxation measured against the integer program of S1
+            integrality_gap_dict[n_scenario] = _integrality_gap(objVal_S1, 42*iteration, n_scenario, num_items, df1=df1, products_price=products_price, machine_daily_time=machine_daily_time, threads=threads_per_worker, cache_path=cache_path, generator=generator, recorder=recorder, time_limit=time_limit, mip_gap=mip_gap, accept_gap=accept_gap)
+        if evaluator:
+            # Out-of-sample value of the components chosen with S1
+            objVal_S1, revenue = evaluate_first_stage(x_S1, held_out(), df1=df1, products_price=products_price, machine_daily_time=machine_daily_time)
         # Compute the stability difference
-        stability_diff = abs(modelS1.objVal - objVal_bigN)
+        stability_diff = abs(objVal_S1 - objVal_bigN)
         stability_diff_dict[n_scenario] = stability_diff
+        stats.update(stability_diff)
         
         # Check if the stability difference is within the tolerance
         if iteration == 0:
             n_scenario += step_iteration
         elif final_scenario == 'No scenario satisfies the CLT conditions':
-            mu = np.mean(list(stability_diff_dict.values()))
-            sigma = np.std(list(stability_diff_dict.values()))
-            z_alpha = norm.ppf(1 - alpha / 2)
-            # print(mu + z_alpha*sigma/np.sqrt(max_iterations), mu - z_alpha*sigma/np.sqrt(max_iterations))
-            
             # Check if the CLT conditions are satisfied
-            if mu + z_alpha*sigma/np.sqrt(iteration+1) > 0 and mu - z_alpha*sigma/np.sqrt(iteration+1) < 0:
+            if stats.clt_satisfied(z_alpha):
                 final_scenario = n_scenario
+                if early_stop:
+                    break
             else:
                 n_scenario += step_iteration
         else:
             n_scenario += step_iteration
 
-    return (final_scenario, stability_diff_dict)
-
-# Perform In-Sample Stability Analysis
-n_scenario_in_sample, stability_dict_in_sample = compute_in_sample_stability()
-
-# Perform Out-of-Sample Stability Analysis
-bigN = 55
-n_scenario_out_sample, stability_dict_out_sample = compute_out_sample_stability(big_n_scenario=bigN)
-
-print(' ')
-print('In-Sample Stability Analysis')
-if n_scenario_in_sample == 'Model not feasible':
-    print(f'Model not feasible')
-elif n_scenario_in_sample == 'No scenario satisfies the CLT conditions':
-    print(f'No scenario satisfies the CLT conditions')
-else:
-    print(f'In-Sample Stability achieved with {n_scenario_in_sample} scenarios and stability difference = {stability_dict_in_sample[n_scenario_in_sample]}')
-
-data = []
-for i,el in enumerate(stability_dict_in_sample.values()):
-    if i == 0:
-        data.append(el)
-        continue
-    elif i == 1:
-        el1 = data.pop()
-        data.append([el1, el])
-    else:
-        el1 = data[i-2].copy()
-        el1.append(el)
-        data.append(el1)
-plt.figure(figsize=(15, 10))
-plt.boxplot(data)
-plt.xticks(ticks=range(len(data)+1), labels=range(2, len(data)+3), rotation=45)
-plt.hlines(0, 0, len(data)+1, colors='r', linestyles='dashed')
-plt.xlabel('Number of scenarios')
-plt.ylabel('Stability difference')
-plt.title('In-Sample Stability Analysis')
-plt.savefig('in_sample_stability.pdf')
-
-
-# stability_dict_in_sample = dict(sorted(stability_dict_in_sample.items(), key=lambda x: x[1], reverse=False))
-# print('The differences in the objective function value for different scenarios are:')
-# for key, value in stability_dict_in_sample.items():
-#     print(f'n_scenario = {key}, stability difference = {value}')
-print(' ')
-
-print('Out-of-Sample Stability Analysis')
-print(f'performed with respect to the {bigN} scenarios')
-
-if n_scenario_out_sample == 'Model not feasible':
-    print(f'Model not feasible')
-elif n_scenario_out_sample == 'No scenario satisfies the CLT conditions':
-    print(f'No scenario satisfies the CLT conditions')
-else:
-    print(f'Out-of-Sample Stability achieved with {n_scenario_out_sample} scenarios and stability difference = {stability_dict_out_sample[n_scenario_out_sample]}')
-
-data = []
-for i,el in enumerate(stability_dict_out_sample.values()):
-    if i == 0:
-        data.append(el)
-        continue
-    elif i == 1:
-        el1 = data.pop()
-        data.append([el1, el])
+    if n_workers > 1 and not incremental:
+        executor.shutdown(cancel_futures=True)
+    return _with_integrality_gaps((final_scenario, stability_diff_dict), relaxation, integrality_gap_dict)
+
+class RunningStats:
+    #
+    # This class keeps the running mean and standard deviation (Welford's algorithm) of the stability differences
+    #
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def update(self, value:float):
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (value - self.mean)
+
+    @property
+    def std(self):
+        # population standard deviation, as np.std
+        return math.sqrt(self._m2 / self.n) if self.n > 0 else 0.0
+
+    def clt_satisfied(self, z_alpha:float):
+        # True if the confidence interval of the mean contains 0
+        half_width = z_alpha * self.std / math.sqrt(self.n)
+        return self.mean + half_width > 0 and self.mean - half_width < 0
+
+def _adaptive_sweep(probe, starting_n_scenario:int, step_iteration:int, max_iterations:int, z_alpha:float, max_n_scenario:int):
+    #
+    # This function searches the smallest number of scenarios at which the CLT conditions are satisfied:
+    # the number of scenarios is doubled until they are satisfied and then it is bisected between the last
+    # number of scenarios that does not satisfy them and the first one that does, with resolution step_iteration.
+    # As in the linear sweep the conditions are checked on the running statistics of all the differences computed so far.
+    #
+    # INPUTS:
+    # probe: function (iteration, n_scenario) returning the stability difference, None if the model is not feasible
+    # max_n_scenario: maximum number of scenarios of the doubling (the last number of scenarios of the linear sweep),
+    #   the search stops when it is reached without satisfying the CLT conditions
+    #
+    # OUTPUT: as compute_in_sample_stability, stability_diff_dict is sorted by number of scenarios
+    #
+    stats = RunningStats()
+    stability_diff_dict = {}
+    n_low, n_high = None, None
+    n_scenario = starting_n_scenario
+    for iteration in range(max_iterations):
+        stability_diff = probe(iteration, n_scenario)
+        if stability_diff is None:
+            return ('Model not feasible', dict(sorted(stability_diff_dict.items())))
+        stability_diff_dict[n_scenario] = stability_diff
+        stats.update(stability_diff)
+
+        if iteration > 0 and stats.clt_satisfied(z_alpha):
+            n_high = n_scenario
+        else:
+            n_low = n_scenario
+
+        if n_high is None:
+            if n_scenario >= max_n_scenario:
+                break
+            n_scenario = min(max(2*n_scenario, n_scenario + step_iteration), max_n_scenario)
+        elif n_low is None or n_high - n_low <= step_iteration:
+            return (n_high, dict(sorted(stability_diff_dict.items())))
+        else:
+            n_scenario = n_low + step_iteration * max(1, (n_high - n_low) // (2*step_iteration))
+
+    final_scenario = n_high if n_high is not None else 'No scenario satisfies the CLT conditions'
+    return (final_scenario, dict(sorted(stability_diff_dict.items())))
+
+def _solve_sampled_model(seed:int, n_scenario:int, num_items:int, df1:pd.DataFrame = None, products_price:dict = None, machine_daily_time:dict = None, threads:int = None, cache_path:str = None, generator:ScenarioGenerator = None, backend:str = 'gurobi', recorder:SolveRecorder = None, time_limit:float = None, mip_gap:float = None, accept_gap:float = None, relaxation:str = None):
+    #
+    # This function samples n_scenario demand scenarios from the stream seed of the generator
+    # (from np.random.RandomState(seed) when generator is None) and solves the stochastic model on them,
+    # the statistics of the solve are recorded in recorder (if not None) with the seed
+    #
+    # OUTPUT:
+    # objective value of the optimized model and array with the number of each component
+    # (of the rounded solution with relaxation = 'round'),
+    # (None, None) if it is not possible to find an optimal solution (or an incumbent within accept_gap)
+    #
+    from model import gurobi_solution # type: ignore
+    from solve_cache import cached_model_variables # type: ignore
+    from scenarios import scenario_stream # type: ignore
+    from backends import ATOProblem, solve_problem # type: ignore
+    demand = scenario_stream(generator, seed, num_items).sample(n_scenario)
+
+    if cache_path is not None:
+        solution = cached_model_variables(df1=df1, products_price=products_price, machine_daily_time=machine_daily_time, demand=demand, cache=_get_cache(cache_path), backend=backend, recorder=None if recorder is None else recorder.child(seed=seed), accept_gap=accept_gap, threads=threads, time_limit=time_limit, mip_gap=mip_gap, relaxation=relaxation)
+        return (solution.objVal, solution.x)
+    if backend != 'gurobi':
+        solution = solve_problem(ATOProblem(df1=df1, products_price=products_price, machine_daily_time=machine_daily_time, demand=demand), backend, threads=threads, time_limit=time_limit, mip_gap=mip_gap, recorder=recorder, seed=seed)
+        if not solution.is_acceptable(accept_gap):
+            print("No optimal solution found.")
+            return (None, None)
+        return (solution.objVal, solution.x)
+
+    # the model is disposed after the solve, only its compact solution is kept (the rounded one with relaxation = 'round')
+    solution = gurobi_solution(df1=df1, products_price=products_price, machine_daily_time=machine_daily_time, demand=demand, threads=threads,
+                               recorder=None if recorder is None else recorder.child(seed=seed), time_limit=time_limit, mip_gap=mip_gap, accept_gap=accept_gap, relaxation=relaxation)
+    if solution is None:
+        return (None, None)
+    return (solution.objVal, solution.x)
+
+def _integrality_gap(objVal_relaxed:float, seed:int, n_scenario:int, num_items:int, **data):
+    # Solves the integer program of the sample seed and returns the relative difference from the objective value of its relaxation
+    objVal, x = _solve_sampled_model(seed, n_scenario, num_items, **data)
+    if objVal is None:
+        return None
+    return abs(objVal_relaxed - objVal) / max(abs(objVal), 1e-9)
+
+def _with_integrality_gaps(output:tuple, relaxation:str, integrality_gap_dict:dict):
+    # Adds integrality_gap_dict to the output of the stability analysis when the models are relaxed
+    return output if relaxation is None else output + (integrality_gap_dict,)
+
+def _submit_iteration(executor:ProcessPoolExecutor, seeds:list, n_scenario:int, num_items:int, data:dict):
+    # Submits to the process pool one solve for each seed, returns (n_scenario, list of futures)
+    return (n_scenario, [executor.submit(_solve_sampled_model_in_worker, seed, n_scenario, num_items, **data) for seed in seeds])
+
+def _solve_sampled_model_in_worker(seed:int, n_scenario:int, num_items:int, recorder:SolveRecorder = None, **data):
+    # Runs _solve_sampled_model in a worker process, returns its output and the records of the solve (that are not shared between processes)
+    if recorder is None:
+        return _solve_sampled_model(seed, n_scenario, num_items, **data) + ([],)
+    recorder.records = []
+    return _solve_sampled_model(seed, n_scenario, num_items, recorder=recorder, **data) + (recorder.records,)
+
+def _collect(future, recorder:SolveRecorder = None):
+    # Returns the output of _solve_sampled_model from the future of _solve_sampled_model_in_worker, adding its records to recorder
+    objVal, x, records = future.result()
+    if recorder is not None:
+        recorder.extend(records)
+    return (objVal, x)
+
+def plot_stability(stability_dict:dict, title:str, path:str):
+    #
+    # This function saves in path the boxplots of the stability differences computed up to each number of scenarios
+    # The box statistics are computed incrementally by stability_report.StabilityReport and also saved
+    # in a npz file with the same name of the plot (they can be plotted again with stability_report.plot_box_stats)
+    #
+    from stability_report import StabilityReport, plot_box_stats # type: ignore
+    report = StabilityReport()
+    report.extend(stability_dict.items())
+    report.save(os.path.splitext(path)[0] + '.npz')
+    plot_box_stats(report.columns, title, path)
+
+def _print_result(n_scenario, stability_dict:dict, name:str, integrality_gap_dict:dict = None):
+    if n_scenario == 'Model not feasible':
+        print(f'Model not feasible')
+    elif n_scenario == 'No scenario satisfies the CLT conditions':
+        print(f'No scenario satisfies the CLT conditions')
     else:
-        el1 = data[i-2].copy()
-        el1.append(el)
-        data.append(el1)
-plt.figure(figsize=(15, 10))
-plt.boxplot(data)
-plt.xticks(ticks=range(len(data)+1), labels=range(2, len(data)+3), rotation=45)
-plt.hlines(0, 0, len(data)+1, colors='r', linestyles='dashed')
-plt.xlabel('Number of scenarios')
-plt.ylabel('Stability difference')
-plt.title('In-Sample Stability Analysis')
-plt.savefig('out_sample_stability.pdf')
-
-
-# stability_dict_out_sample = dict(sorted(stability_dict_out_sample.items(), key=lambda x: x[1], reverse=False))
-# print('The differences in the objective function value for different scenarios are:')
-# for key, value in stability_dict_out_sample.items():
-#     print(f'n_scenario = {key}, stability difference = {value}')
\ No newline at end of file
+        print(f'{name} Stability achieved with {n_scenario} scenarios and stability difference = {stability_dict[n_scenario]}')
+    for n_checked, gap in (integrality_gap_dict or {}).items():
+        print(f'Integrality gap of the relaxation with {n_checked} scenarios = {gap}')
+
+def main(argv:list = None):
+    #
+    # Command line interface of the stability analysis:
+    #   python main_stability.py {in-sample,out-of-sample,both} [options]
+    # The boxplots of the stability differences are saved in in_sample_stability.pdf and out_sample_stability.pdf
+    # (in --output-dir), unless --no-plot is given.
+    #
+    parser = argparse.ArgumentParser(description='In-Sample and Out-of-Sample stability analysis of the ATO model')
+    parser.add_argument('analysis', choices=['in-sample', 'out-of-sample', 'both'], nargs='?', default='both')
+    parser.add_argument('--starting-n-scenario', type=int, default=2)
+    parser.add_argument('--max-iterations', type=int, default=50)
+    parser.add_argument('--step-iteration', type=int, default=1)
+    parser.add_argument('--alpha-in', type=float, default=0.008, help='alpha of the In-Sample analysis')
+    parser.add_argument('--alpha-out', type=float, default=0.025, help='alpha of the Out-of-Sample analysis')
+    parser.add_argument('--big-n', type=int, default=55, help='number of scenarios of the reference model of the Out-of-Sample analysis')
+    parser.add_argument('--sweep', choices=['linear', 'adaptive'], default='linear')
+    parser.add_argument('--early-stop', action='store_true', help='stop at the first number of scenarios that satisfies the CLT conditions')
+    parser.add_argument('--incremental', action='store_true')
+    parser.add_argument('--n-workers', type=int, default=1)
+    parser.add_argument('--threads-per-worker', type=int, default=None)
+    parser.add_argument('--cache-path', type=str, default=None)
+    parser.add_argument('--backend', choices=['gurobi', 'highs'], default='gurobi')
+    parser.add_argument('--time-limit', type=float, default=None)
+    parser.add_argument('--mip-gap', type=float, default=None)
+    parser.add_argument('--accept-gap', type=float, default=None, help='use the solves stopped (e.g. by --time-limit) with an incumbent within this relative gap')
+    parser.add_argument('--relaxation', choices=['lp', 'round'], default=None, help='solve the LP relaxation of the sampled models (rounded with round)')
+    parser.add_argument('--output-dir', type=str, default='.')
+    parser.add_argument('--no-plot', action='store_true')
+    args = parser.parse_args(argv)
+
+    options = dict(starting_n_scenario=args.starting_n_scenario, max_iterations=args.max_iterations, step_iteration=args.step_iteration,
+                   sweep=args.sweep, early_stop=args.early_stop, incremental=args.incremental, n_workers=args.n_workers, threads_per_worker=args.threads_per_worker,
+                   cache_path=args.cache_path, backend=args.backend, time_limit=args.time_limit, mip_gap=args.mip_gap,
+                   accept_gap=args.accept_gap, relaxation=args.relaxation)
+    if args.analysis in ('in-sample', 'both'):
+        # Perform In-Sample Stability Analysis
+        n_scenario_in_sample, stability_dict_in_sample, *integrality_gaps = compute_in_sample_stability(alpha=args.alpha_in, **options)
+        print(' ')
+        print('In-Sample Stability Analysis')
+        _print_result(n_scenario_in_sample, stability_dict_in_sample, 'In-Sample', *integrality_gaps)
+        if not args.no_plot:
+            plot_stability(stability_dict_in_sample, 'In-Sample Stability Analysis', f'{args.output_dir}/in_sample_stability.pdf')
+
+    if args.analysis in ('out-of-sample', 'both'):
+        # Perform Out-of-Sample Stability Analysis
+        n_scenario_out_sample, stability_dict_out_sample, *integrality_gaps = compute_out_sample_stability(big_n_scenario=args.big_n, alpha=args.alpha_out, **options)
+        print(' ')
+        print('Out-of-Sample Stability Analysis')
+        print(f'performed with respect to the {args.big_n} scenarios')
+        _print_result(n_scenario_out_sample, stability_dict_out_sample, 'Out-of-Sample', *integrality_gaps)
+        if not args.no_plot:
+            plot_stability(stability_dict_out_sample, 'Out-of-Sample Stability Analysis', f'{args.output_dir}/out_sample_stability.pdf')
+
+if __name__ == '__main__':
+    main()
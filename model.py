@@ -1,10 +1,22 @@
-import gurobipy as gp # type: ignore
-from gurobipy import GRB # type: ignore
+try:
+    import gurobipy as gp # type: ignore
+    from gurobipy import GRB # type: ignore
+except ImportError:
+    # without gurobi only the models of the other backends (backends.py) can be solved
+    gp = None
+    GRB = None
 import pandas as pd # type: ignore
 import numpy as np # type: ignore
+import scipy.sparse as sp # type: ignore
 import csv
+import json
+import os
+import time
+from collections.abc import Iterator
+from scenario_reduction import reduce_scenarios # type: ignore
+from scenarios import legacy_normal_demand # type: ignore
 
-def gurobi_model_variables(df1:pd.DataFrame = None, products_price:dict = None, machine_daily_time:dict = None, demand:list = None, prob:list = None, path:str = None):
+def gurobi_model_variables(df1:pd.DataFrame = None, products_price:dict = None, machine_daily_time:dict = None, demand:list = None, prob:list = None, path:str = None, threads:int = None, reduction:str = None, n_reduced_scenarios:int = None, recorder = None, time_limit:float = None, mip_gap:float = None, accept_gap:float = None, aggregate_gozinto:bool = True, relaxation:str = None, presolve:bool = False):
     #
     # This function creates a gurobi model to solve the ATO problem with stochastic demand
     #
@@ -18,83 +30,730 @@ def gurobi_model_variables(df1:pd.DataFrame = None, products_price:dict = None,
     # demand: list with the demand of each product in each scenario
     # prob: list with the probability of each scenario
     # path: path to the data files if the function is called from a different directory
+    # threads: value of the gurobi parameter Threads (None for the gurobi default)
+    # reduction: if not None the scenarios are reduced with scenario_reduction.reduce_scenarios before building the model:
+    #   'merge' merges the identical demand vectors, 'fast_forward' or 'kmedoids' also reduce them to n_reduced_scenarios.
+    #   The reduction is stored in model_stochastic._reduction (reduced demand and probabilities, distance bound
+    #   and index of the reduced scenario of each original one); y has one column for each reduced scenario
+    # n_reduced_scenarios: number of scenarios kept by the reduction
+    # recorder: instrumentation.SolveRecorder where the statistics of the solve are recorded, None to record nothing
+    # time_limit: value of the gurobi parameter TimeLimit in seconds (None for no limit)
+    # mip_gap: value of the gurobi parameter MIPGap, relative gap at which the solve stops (None for the gurobi default)
+    # accept_gap: if not None, a model stopped before optimality (e.g. by time_limit) is returned when its best incumbent
+    #   is within this relative gap from the bound, otherwise only the optimal models are returned
+    # aggregate_gozinto: if True the gozinto constraints of the components with the same gozinto row are written
+    #   once per scenario (see group_gozinto_signatures), the optimal solutions do not change
+    # relaxation: None to solve the integer program, 'lp' to solve its LP relaxation (x and y are continuous),
+    #   'round' to solve the LP relaxation and then round its solution with round_lp_solution
+    # presolve: if True the bounds of x and y are tightened and the dead components and the unprofitable products
+    #   are removed before building the model (see presolve_model), the PresolveReport is model_stochastic._presolve
+    #   and x and y only have the kept components and products (the arrays of model_stochastic._solution have all of them)
     # 
     # OUTPUT:
     # model_stochastic: optimized model 
+    #   the time in seconds spent to build the model is stored in model_stochastic._build_time,
+    #   the time spent by the solver is model_stochastic.Runtime.
+    #   model_stochastic.status is GRB.OPTIMAL or, with accept_gap, the status at which the solve stopped (e.g. GRB.TIME_LIMIT):
+    #   model_stochastic.objVal is then the best incumbent, model_stochastic.ObjBound the bound and model_stochastic.MIPGap their gap
+    #   With relaxation the objective value is the one of the LP relaxation (an upper bound of the integer optimum) and,
+    #   with 'round', model_stochastic._rounded is (objVal, x, y) of the rounded integer solution (a lower bound)
+    #   The solution is also in model_stochastic._solution (ModelSolution, see extract_solution): it does not need the model,
+    #   that can be disposed with model_stochastic.dispose() (gurobi_solution does it)
+    # y: MVar (n_products, n_scenarios) with the amount of each product produced in each scenario
+    # x: MVar (n_components,) with the number of each component
     # ATTENTION: when it is not possible to find an optimal solution, the function returns None
+
+    (model_stochastic, y, x) = build_model_variables(df1 = df1, products_price = products_price, machine_daily_time = machine_daily_time, demand = demand, prob = prob, path = path, threads = threads, reduction = reduction, n_reduced_scenarios = n_reduced_scenarios, time_limit = time_limit, mip_gap = mip_gap, aggregate_gozinto = aggregate_gozinto, relaxation = relaxation, presolve = presolve)
+
+    ## Optimize the model
+    if recorder is None:
+        model_stochastic.optimize()
+    else:
+        recorder.optimize(model_stochastic, n_scenarios = y.shape[1])
+
+    ## Output solution details
+    if read_solution(model_stochastic, y, x, accept_gap) is not None:
+        return (model_stochastic, y, x)
+    else:
+        print("No optimal solution found.")
+        return (None, None, None)
+
+def gurobi_solution(**kwargs):
+    #
+    # This function solves the ATO problem as gurobi_model_variables (with the same inputs),
+    # extracts its solution and disposes the gurobi model, so that long sweeps do not keep the models in memory
+    #
+    # OUTPUT:
+    # solution: ModelSolution, None if no optimal solution is found (or no incumbent within accept_gap)
+    #
+    (model_stochastic, y, x) = gurobi_model_variables(**kwargs)
+    if model_stochastic is None:
+        return None
+    solution = model_stochastic._solution
+    model_stochastic.dispose()
+    return solution
+
+class ModelSolution:
+    #
+    # This class is a compact solution of the ATO problem with stochastic demand, made only of NumPy arrays
+    #
+    # ATTRIBUTES:
+    # objVal: objective value (expected profit)
+    # status: gurobi status of the solve
+    # Runtime: time in seconds spent by gurobi
+    # obj_bound, mip_gap: bound of the optimal objective value and relative gap of objVal from it (None for an LP)
+    # x: array (n_components,) with the number of each component
+    # y: array (n_products, n_scenarios) with the amount of each product produced in each scenario
+    # prob: array (n_scenarios,) with the probability of each scenario
+    # revenue: array (n_products,) with the expected revenue of each product
+    # cost: array (n_components,) with the cost of each component (number of components times fixed cost)
+    # scenario_revenue: array (n_scenarios,) with the revenue in each scenario
+    #
+    def __init__(self, objVal:float, status:int, Runtime:float, x:np.ndarray, y:np.ndarray, price:np.ndarray, cost:np.ndarray, prob:np.ndarray, obj_bound:float = None, mip_gap:float = None):
+        self.objVal = objVal
+        self.status = status
+        self.Runtime = Runtime
+        self.obj_bound = obj_bound
+        self.mip_gap = mip_gap
+        self.x = x
+        self.y = y
+        self.prob = prob
+        self.scenario_revenue = price @ y
+        self.revenue = price * (y @ prob)
+        self.cost = cost * x
+
+    @property
+    def total_revenue(self):
+        return float(self.revenue.sum())
+
+    @property
+    def total_cost(self):
+        return float(self.cost.sum())
+
+def read_solution(model_stochastic, y, x, accept_gap:float = None):
+    #
+    # This function reads the solution of an optimized model of build_model_variables when it can be used (see is_acceptable):
+    # with relaxation = 'round' the LP solution is first rounded with round_lp_solution (model_stochastic._rounded).
+    # Every solver of the model (gurobi_model_variables, solve_cache, solve_service) reads its solution with it
+    #
+    # OUTPUT:
+    # solution: ModelSolution, also stored in model_stochastic._solution, None if the solution cannot be used
+    #
+    if not is_acceptable(model_stochastic, accept_gap):
+        return None
+    if hasattr(model_stochastic, '_rounding_data'):
+        model_stochastic._rounded = round_lp_solution(x.X, y.X, *model_stochastic._rounding_data)
+    model_stochastic._solution = extract_solution(model_stochastic, y, x)
+    return model_stochastic._solution
+
+def extract_solution(model, y, x):
+    #
+    # This function reads the solution of an optimized model of build_model_variables with one query of x.X and one of y.X
+    # (instead of one query for each variable, e.g. y[j, s].x), with relaxation = 'round' it is the rounded solution
+    #
+    # OUTPUT:
+    # solution: ModelSolution
+    #
+    price, cost, prob = model._objective_data
+    is_mip = model.IsMIP == 1
+    obj_bound = model.ObjBound if is_mip else None
+    mip_gap = model.MIPGap if is_mip else None
+    if hasattr(model, '_rounded'):
+        objVal, x_value, y_value = model._rounded
+    else:
+        objVal, x_value, y_value = model.objVal, x.X, y.X
+    if hasattr(model, '_presolve'):
+        x_value, y_value = model._presolve.expand(x_value, y_value)
+    return ModelSolution(objVal, model.status, model.Runtime, x_value, y_value, price, cost, prob, obj_bound, mip_gap)
+
+def build_model_variables(df1:pd.DataFrame = None, products_price:dict = None, machine_daily_time:dict = None, demand:list = None, prob:list = None, path:str = None, threads:int = None, reduction:str = None, n_reduced_scenarios:int = None, time_limit:float = None, mip_gap:float = None, aggregate_gozinto:bool = True, relaxation:str = None, presolve:bool = False):
+    #
+    # This function creates, without optimizing it, the gurobi model of the ATO problem with stochastic demand
+    #
+    # INPUTS: as in gurobi_model_variables
+    #
+    # OUTPUT:
+    # model_stochastic: model to be optimized, the time in seconds spent to build it is stored in model_stochastic._build_time
+    #   with relaxation = 'round' the arguments of round_lp_solution other than x and y are in model_stochastic._rounding_data
+    #   the MConstr of the working_hours constraints is model_stochastic._working_hours
+    #   the prices of the products, the costs of the components and the probabilities of the scenarios are in model_stochastic._objective_data
+    #   with presolve the PresolveReport is in model_stochastic._presolve, its components and products are the rows and columns
+    #   of the data kept in the model (y has a row for each kept product)
+    #   with reduction the reduced demand (of all the products), prob, distance and assignment are in model_stochastic._reduction
+    # y: MVar (n_products, n_scenarios) with the amount of each product produced in each scenario
+    # x: MVar (n_components,) with the number of each component
     
     # if the input is not provided, use the default values
 
     if df1 is None:
         df1, products_price, machine_daily_time, products, num_components, num_items, num_machines = get_data(path = path)
+    if relaxation not in (None, 'lp', 'round'):
+        raise ValueError(f"Unknown relaxation '{relaxation}'")
 
-    if demand is None:
-        np.random.seed(42)
-        demand = np.random.normal(loc=100, scale=40, size=num_items).astype(int)
-        demand = np.clip(demand, 0, None)
-        demand = [demand]
-        prob = [1]
-    else:
-        if prob is None:
-            prob = [1/len(demand)]*len(demand)
+    start_time = time.perf_counter()
+    processing_time, gozinto, cost, price, machine_time = get_model_arrays(df1, products_price, machine_daily_time, sparse = True)
+    num_components, num_items = gozinto.shape
+    demand, prob = get_scenarios(demand, prob, num_items)
+    if reduction is not None:
+        demand, prob, distance, assignment = reduce_scenarios(demand, prob, n_target = n_reduced_scenarios, method = reduction)
+        # the reduced scenarios of all the products, before the presolve removes some of them
+        reduction_data = {'demand': demand, 'prob': prob, 'distance': distance, 'assignment': assignment}
     num_scenarios = len(demand)
+    x_ub, y_ub = np.inf, np.inf
+    report = None
+    if presolve:
+        report = presolve_model(processing_time, gozinto, cost, price, machine_time, demand)
+        full_price, full_cost = price, cost
+        processing_time, gozinto = processing_time[report.components], gozinto[report.components][:, report.products]
+        cost, price = cost[report.components], price[report.products]
+        demand = demand[:, report.products]
+        num_components, num_items = gozinto.shape
+        x_ub, y_ub = report.x_ub, report.y_ub
 
     # Create a new model
     model_stochastic = gp.Model("ato")
+    if presolve:
+        model_stochastic._presolve = report
+    if reduction is not None:
+        model_stochastic._reduction = reduction_data
     model_stochastic.setParam('OutputFlag', 0)
+    set_parameters(model_stochastic, threads, time_limit, mip_gap)
+    model_stochastic._objective_data = (price, cost, prob) if report is None else (full_price, full_cost, prob)
+    if relaxation == 'round':
+        model_stochastic._rounding_data = (gozinto, price, cost, demand, prob)
+    vtype = GRB.INTEGER if relaxation is None else GRB.CONTINUOUS
 
     # Decision variables
-    # y[j] is the amount of product j produced
-    y = model_stochastic.addVars(num_items, num_scenarios, vtype=GRB.INTEGER, name="y")
+    # y[j, s] is the amount of product j produced in scenario s
+    # Objective function: maximize the expected revenue - fixed costs of the components
+    y = model_stochastic.addMVar((num_items, num_scenarios), vtype=vtype, ub=y_ub, obj=np.outer(price, prob), name="y")
 
     # x[i] is the number of i components 
-    x = model_stochastic.addVars(num_components, vtype=GRB.INTEGER, name="x")
-
-    # Objective function: minimize fixed costs + transportation costs
-    model_stochastic.setObjective(
-        - gp.quicksum(df1.iloc[i,-1] * x[i] for i in range(num_components) ) +
-        gp.quicksum(prob[s] * gp.quicksum(products_price[products[j]] * y[j, s] for j in range(num_items)) for s in range(num_scenarios)),
-        GRB.MAXIMIZE
-    )
+    x = model_stochastic.addMVar(num_components, vtype=vtype, ub=x_ub, obj=-cost, name="x")
+    model_stochastic.ModelSense = GRB.MAXIMIZE
 
     # Constraint 1: the amount of hours of work for every piece must be inferior to the threshold for the machine
-    model_stochastic.addConstrs(
-        (gp.quicksum(df1.iloc[i,j] * x[i] for i in range(num_components)) <= machine_daily_time[list(machine_daily_time.keys())[j]]*7 for j in range(num_machines) ),
-        name="working_hours"
-    )
+    # (the MConstr is kept in model_stochastic._working_hours to change its right hand side, e.g. in what_if.py)
+    model_stochastic._working_hours = model_stochastic.addMConstr(processing_time.T, x, '<', machine_time*7, name="working_hours")
 
-    # Constraint 2: the number of products of every type must be geq the demand
-    model_stochastic.addConstrs(
-        (y[j, s] <= demand[s][j] for j in range(num_items) for s in range(num_scenarios)),
-        name = "qty_products"
-    )
+    # Constraint 2: the number of products of every type must be leq the demand
+    # (rows ordered by product and then by scenario, as y.reshape(-1)), after the presolve it is the upper bound of y
+    if report is None:
+        model_stochastic.addMConstr(sp.identity(num_items*num_scenarios, format='csr'), y.reshape(-1), '<', demand.T.reshape(-1), name="qty_products")
 
     # Constraint 3: gozinto factor
-    model_stochastic.addConstrs(
-        (gp.quicksum(df1.iloc[i,j+num_machines] * y[j, s] for j in range(num_items)) <= x[i] for i in range(num_components) for s in range(num_scenarios)),
-        name="gozinto"
-    )
+    # row i*n_scenarios + s is sum_j gozinto[i, j] * y[j, s] - x[i] <= 0
+    # When some components have the same gozinto row they are grouped (see group_gozinto_signatures):
+    # row g*n_scenarios + s is sum_j signatures[g, j] * y[j, s] - z[g] <= 0, with z[g] <= x[i] for every component i of the group g
+    signatures, linking = group_gozinto_signatures(gozinto) if aggregate_gozinto else (None, None)
+    if signatures is None:
+        signatures, capacity = sp.csr_matrix(gozinto), x.tolist()
+    else:
+        z = model_stochastic.addMVar(signatures.shape[0], name="z")
+        model_stochastic.addMConstr(linking, z.tolist() + x.tolist(), '<', np.zeros(linking.shape[0]), name="gozinto_groups")
+        capacity = z.tolist()
+    gozinto_matrix = sp.hstack([
+        sp.kron(signatures, sp.identity(num_scenarios)),
+        -sp.kron(sp.identity(len(capacity)), np.ones((num_scenarios, 1)))
+    ], format='csr')
+    model_stochastic.addMConstr(gozinto_matrix, y.reshape(-1).tolist() + capacity, '<', np.zeros(len(capacity)*num_scenarios), name="gozinto")
+    model_stochastic.update()
+    model_stochastic._build_time = time.perf_counter() - start_time
+    return (model_stochastic, y, x)
 
-    ## Optimize the model
-    model_stochastic.optimize()
+class PresolveReport:
+    #
+    # This class is the result of presolve_model
+    #
+    # ATTRIBUTES:
+    # components, products: arrays with the indices of the kept components and products
+    # x_ub: array (n_kept_components,) with the upper bounds of x
+    # y_ub: array (n_kept_products, n_scenarios) with the upper bounds of y
+    # removed_components, removed_products: lists of (index, reason) of the removed components and products
+    # num_components, num_items: number of components and products before the presolve
+    #
+    def __init__(self, components:np.ndarray, products:np.ndarray, x_ub:np.ndarray, y_ub:np.ndarray, removed_components:list, removed_products:list, num_components:int, num_items:int):
+        self.components = components
+        self.products = products
+        self.x_ub = x_ub
+        self.y_ub = y_ub
+        self.removed_components = removed_components
+        self.removed_products = removed_products
+        self.num_components = num_components
+        self.num_items = num_items
 
-    ## Output solution details
+    def expand(self, x:np.ndarray, y:np.ndarray):
+        # Returns the solution x (n_components,) and y (n_products, n_scenarios) of the original problem,
+        # with 0 for the removed components and products, from the one of the model with the kept ones
+        x_full = np.zeros(self.num_components)
+        x_full[self.components] = x
+        y_full = np.zeros((self.num_items, y.shape[1]))
+        y_full[self.products] = y
+        return (x_full, y_full)
+
+    def summary(self, components:list = None, products:list = None):
+        # Returns a description of what has been removed, with the names of the components and products if given
+        name = lambda names, k: k if names is None else names[k]
+        lines = [f'Presolve: {len(self.removed_components)} components and {len(self.removed_products)} products removed']
+        lines += [f'  component {name(components, k)}: {reason}' for k, reason in self.removed_components]
+        lines += [f'  product {name(products, k)}: {reason}' for k, reason in self.removed_products]
+        return '\n'.join(lines)
+
+def presolve_model(processing_time, gozinto, cost:np.ndarray, price:np.ndarray, machine_time:np.ndarray, demand:np.ndarray, tol:float = 1e-9):
+    #
+    # This function derives, before the model is built, bounds of the variables that are satisfied by an optimal
+    # solution and the components and products that can be removed without changing the optimal objective value:
+    # - x[i] <= working hours of each machine / processing time of the component in it (capacity)
+    # - x[i] <= max_s sum_j gozinto[i, j] * demand[s][j] (more components than the largest use only cost),
+    #   for the components with cost >= 0
+    # - y[j, s] <= demand[s][j] and y[j, s] <= x_ub[i] / gozinto[i, j] for the components of the product
+    # - the products with price <= 0 or that cannot be produced (y_ub = 0) are removed
+    # - with a single scenario, the products whose price is at most the cost of their components
+    #   (sum_i cost[i] * floor(gozinto[i, j]), so that it also holds with fractional gozinto factors) are removed:
+    #   without them the same components minus the ones they use are bought.
+    #   With more scenarios a component bought for a product can be used by another one in some scenarios, so they are kept
+    # - the components with cost >= 0 that are not used by any (kept) product are removed
+    #
+    # INPUTS:
+    # processing_time, gozinto, cost, price, machine_time: as the output of get_model_arrays (dense or sparse)
+    # demand: array (n_scenarios, n_products)
+    #
+    # OUTPUT:
+    # report: PresolveReport
+    #
+    # ATTENTION: the processing times and the gozinto factors must not be negative
+    #
+    processing_time = sp.coo_matrix(processing_time)
+    gozinto = sp.csr_matrix(gozinto, dtype=float)
+    num_components, num_items = gozinto.shape
+    demand = np.asarray(demand, dtype=float)
+
+    # Capacity of the machines
+    capacity = np.full(num_components, np.inf)
+    positive = processing_time.data > 0
+    np.minimum.at(capacity, processing_time.row[positive], np.floor(machine_time[processing_time.col[positive]] * 7 / processing_time.data[positive] + tol))
+
+    def product_bounds(x_ub):
+        # y_ub[j, s] = min(demand[s][j], min_i floor(x_ub[i] / gozinto[i, j]))
+        coo = gozinto.tocoo()
+        used = coo.data > 0
+        limit = np.full(num_items, np.inf)
+        np.minimum.at(limit, coo.col[used], np.floor(x_ub[coo.row[used]] / coo.data[used] + tol))
+        return np.minimum(demand.T, limit[:, None])
+
+    def component_bounds(products):
+        # x_ub[i] = min(capacity, max_s sum_j gozinto[i, j] * demand[s][j]) over the given products, only capacity if cost < 0
+        used = np.ceil(np.asarray(gozinto[:, products] @ demand[:, products].T).max(axis=1, initial=0) - tol)
+        return np.where(cost >= 0, np.minimum(capacity, used), capacity)
+
+    # Products
+    all_products = np.arange(num_items)
+    y_ub = product_bounds(component_bounds(all_products))
+    removed_products = []
+    bom_cost = gozinto.floor().T @ cost if len(demand) == 1 else None
+    uses_negative_cost = (gozinto > 0).T.astype(float) @ (cost < 0).astype(float) > 0
+    for j in range(num_items):
+        if price[j] <= 0:
+            removed_products.append((j, 'price <= 0'))
+        elif not np.any(y_ub[j] > 0):
+            removed_products.append((j, 'cannot be produced (no demand or no capacity)'))
+        elif bom_cost is not None and not uses_negative_cost[j] and price[j] <= bom_cost[j]:
+            removed_products.append((j, f'price {price[j]} <= cost of the components {bom_cost[j]}'))
+    products = np.setdiff1d(all_products, [j for j, reason in removed_products])
+
+    # Components
+    x_ub = component_bounds(products)
+    used_by_kept = np.asarray(abs(gozinto[:, products]).sum(axis=1)).ravel() > 0
+    removed_components = [(i, 'not used by any product' if gozinto[i].nnz == 0 else 'only used by removed products')
+                          for i in range(num_components) if not used_by_kept[i] and cost[i] >= 0]
+    components = np.setdiff1d(np.arange(num_components), [i for i, reason in removed_components])
+    y_ub = product_bounds(x_ub)[products]
+    return PresolveReport(components, products, x_ub[components], y_ub, removed_components, removed_products, num_components, num_items)
+
+def round_lp_solution(x:np.ndarray, y:np.ndarray, gozinto, price:np.ndarray, cost:np.ndarray, demand:np.ndarray, prob:np.ndarray, tol:float = 1e-6):
+    #
+    # This function rounds a solution of the LP relaxation of the ATO problem to a feasible integer solution:
+    # - x is rounded down, which keeps the working_hours constraints satisfied (the processing times are not negative)
+    # - y is rounded down and, where the rounded x is not enough, the cheapest products are reduced (repair)
+    # - the remaining components are used to produce more of the most expensive products, up to the demand (fill)
+    # - x is reduced to the largest number of components used in a scenario (the other ones only cost)
+    #
+    # INPUTS:
+    # x: array (n_components,), y: array (n_products, n_scenarios), solution of the LP relaxation
+    # gozinto: matrix (n_components, n_products), dense or sparse
+    # price, cost, prob: arrays of the prices of the products, of the costs of the components and of the probabilities of the scenarios
+    # demand: array (n_scenarios, n_products)
+    #
+    # OUTPUT:
+    # objVal: expected profit of the rounded solution
+    # x: array (n_components,), y: array (n_products, n_scenarios) of the rounded solution
+    #
+    gozinto = sp.csc_matrix(gozinto, dtype=float, copy=True)
+    gozinto.eliminate_zeros()
+    x = np.floor(np.asarray(x) + tol)
+    y = np.minimum(np.floor(np.asarray(y) + tol), demand.T)
+    used = gozinto @ y
+
+    # Repair: remove the cheapest products from the components that are not enough
+    for j in np.argsort(price):
+        rows = gozinto.indices[gozinto.indptr[j]:gozinto.indptr[j + 1]]
+        factors = gozinto.data[gozinto.indptr[j]:gozinto.indptr[j + 1]]
+        excess = np.maximum(used[rows] - x[rows, None], 0)
+        remove = np.minimum(y[j], np.ceil(excess / factors[:, None] - tol).max(axis=0, initial=0))
+        y[j] -= remove
+        used[rows] -= factors[:, None] * remove
+
+    # Fill: produce more of the most expensive products with the components left
+    for j in np.argsort(-price):
+        rows = gozinto.indices[gozinto.indptr[j]:gozinto.indptr[j + 1]]
+        factors = gozinto.data[gozinto.indptr[j]:gozinto.indptr[j + 1]]
+        if len(rows) == 0:
+            add = demand[:, j] - y[j]
+        else:
+            add = np.minimum(demand[:, j] - y[j], np.floor((x[rows, None] - used[rows]) / factors[:, None] + tol).min(axis=0))
+        add = np.maximum(add, 0)
+        y[j] += add
+        used[rows] += factors[:, None] * add
+
+    x = np.minimum(x, np.ceil(used.max(axis=1, initial=0) - tol))
+    return (price @ y @ prob - cost @ x, x, y)
+
+def group_gozinto_signatures(gozinto):
+    #
+    # This function groups the components with the same gozinto row (signature).
+    # In a scenario the gozinto constraints sum_j gozinto[i, j] * y[j, s] <= x[i] of the components of a group only differ
+    # in x[i], so they can be replaced by the single constraint sum_j signatures[g, j] * y[j, s] <= z[g] with the
+    # scenario-independent constraints z[g] <= x[i] for every component i of the group g (z[g] is the smallest x[i] of the group).
+    # The components that no product needs (signature 0) have no constraint.
+    #
+    # OUTPUT:
+    # signatures: sparse matrix (n_groups, n_products) with the gozinto row of each group
+    # linking: sparse matrix (n_linked_components, n_groups + n_components) with the rows z[g] - x[i] of the constraints z[g] - x[i] <= 0
+    # ATTENTION: when every component has a different nonzero signature nothing is gained and (None, None) is returned
+    #
+    gozinto = sp.csr_matrix(gozinto, dtype=float, copy=True)
+    gozinto.eliminate_zeros()
+    gozinto.sort_indices()
+    num_components = gozinto.shape[0]
+    groups = np.full(num_components, -1)
+    signature_groups = {}
+    for i in range(num_components):
+        start, end = gozinto.indptr[i], gozinto.indptr[i + 1]
+        if start < end:
+            signature = (gozinto.indices[start:end].tobytes(), gozinto.data[start:end].tobytes())
+            groups[i] = signature_groups.setdefault(signature, len(signature_groups))
+    num_groups = len(signature_groups)
+    if num_groups == num_components:
+        return (None, None)
+
+    linked = np.flatnonzero(groups >= 0)
+    representatives = linked[np.unique(groups[linked], return_index=True)[1]]
+    rows = np.arange(len(linked))
+    linking = sp.hstack([
+        sp.csr_matrix((np.ones(len(linked)), (rows, groups[linked])), shape=(len(linked), num_groups)),
+        sp.csr_matrix((-np.ones(len(linked)), (rows, linked)), shape=(len(linked), num_components))
+    ], format='csr')
+    return (gozinto[representatives], linking)
+
+def set_parameters(model, threads:int = None, time_limit:float = None, mip_gap:float = None):
+    # Sets the gurobi parameters Threads, TimeLimit and MIPGap of a model, the ones that are None are left to the default
+    # (every model of the project sets them with this function)
+    for name, value in (('Threads', threads), ('TimeLimit', time_limit), ('MIPGap', mip_gap)):
+        if value is not None:
+            model.setParam(name, value)
+
+def is_acceptable(model, accept_gap:float = None):
+    #
+    # This function checks if the solution of an optimized gurobi model can be used:
+    # it is optimal or, when accept_gap is not None, the solve stopped before (e.g. because of TimeLimit)
+    # with an incumbent whose relative gap from the bound is at most accept_gap
+    # ATTENTION: an LP (e.g. with relaxation) has no MIP gap, it can be used only if it is optimal
+    #
+    if model.status == GRB.OPTIMAL:
+        return True
+    return accept_gap is not None and model.IsMIP == 1 and model.SolCount > 0 and model.MIPGap <= accept_gap
+
+def gurobi_model(df1:pd.DataFrame = None, products_price:dict = None, machine_daily_time:dict = None, demand:list = None, prob:list = None, path:str = None, threads:int = None, reduction:str = None, n_reduced_scenarios:int = None, time_limit:float = None, mip_gap:float = None, accept_gap:float = None, aggregate_gozinto:bool = True, relaxation:str = None, presolve:bool = False):
+    (model_stochastic, y, x) = gurobi_model_variables(df1 = df1, products_price = products_price, machine_daily_time = machine_daily_time, demand = demand, prob = prob, path = path, threads = threads, reduction = reduction, n_reduced_scenarios = n_reduced_scenarios, time_limit = time_limit, mip_gap = mip_gap, accept_gap = accept_gap, aggregate_gozinto = aggregate_gozinto, relaxation = relaxation, presolve = presolve)
+    return model_stochastic
+    
+def benders_model_variables(df1:pd.DataFrame = None, products_price:dict = None, machine_daily_time:dict = None, demand:list = None, prob:list = None, path:str = None, threads:int = None, gap:float = 1e-4, max_iterations:int = 200, batch_size:int = 1000, return_model:bool = True):
+    #
+    # This function solves the ATO problem with stochastic demand with the L-shaped method (multi-cut Benders decomposition)
+    # The master problem keeps the number of components x and a variable theta[s] with the revenue of each scenario.
+    # For a fixed x the assembly of the products is solved as a LP for every scenario: the scenarios are grouped
+    # in batches and every batch is a block-diagonal LP built once, whose gozinto right-hand side is updated at every iteration.
+    # The duals mu (qty_products) and pi (gozinto) of each scenario give the optimality cut theta[s] <= demand[s] @ mu + pi @ x
+    # ATTENTION: the cuts come from the LP relaxation of the assembly; with 0/1 gozinto factors and two products
+    #   (as in the data folder) the assembly LP has integral optimal solutions, so the bound is exact
+    #
+    # INPUTS:
+    # df1, products_price, machine_daily_time, demand, prob, path, threads: as in gurobi_model_variables
+    # gap: relative gap between the upper bound of the master and the best solution found at which the method stops
+    # max_iterations: maximum number of solves of the master problem
+    # batch_size: number of scenarios solved in the same assembly LP
+    # return_model: if True the extensive form is solved with x fixed at the best solution found
+    #   and (model_stochastic, y, x) is returned as in gurobi_model_variables
+    #
+    # OUTPUT:
+    # (model_stochastic, y, x) if return_model is True, info is stored in model_stochastic._benders_info
+    # (objVal, x, info) otherwise, with x array (n_components,) and info dictionary with the number of iterations,
+    #   the upper bound, the final gap and the time spent in the master and in the subproblems
+    # ATTENTION: when it is not possible to find an optimal solution, the function returns None
+
+    if df1 is None:
+        df1, products_price, machine_daily_time, products, num_components, num_items, num_machines = get_data(path = path)
+
+    processing_time, gozinto, cost, price, machine_time = get_model_arrays(df1, products_price, machine_daily_time, sparse = True)
+    num_components, num_items = gozinto.shape
+    demand, prob = get_scenarios(demand, prob, num_items)
+    num_scenarios = len(demand)
+
+    # Master problem: theta[s] is bounded by the revenue of the whole demand of scenario s
+    master = gp.Model("ato_master")
+    master.setParam('OutputFlag', 0)
+    set_parameters(master, threads)
+    x = master.addMVar(num_components, vtype=GRB.INTEGER, obj=-cost, name="x")
+    theta = master.addMVar(num_scenarios, ub=demand @ price, obj=prob, name="theta")
+    master.ModelSense = GRB.MAXIMIZE
+    master.addMConstr(processing_time.T, x, '<', machine_time*7, name="working_hours")
+
+    # Assembly subproblems
+    batches = [np.arange(first, min(first + batch_size, num_scenarios)) for first in range(0, num_scenarios, batch_size)]
+    subproblems = [_assembly_subproblem(gozinto, price, demand[batch], threads) for batch in batches]
+
+    info = {'iterations': 0, 'cuts': 0, 'upper_bound': np.inf, 'gap': np.inf, 'master_time': 0.0, 'subproblem_time': 0.0}
+    best_value = -np.inf
+    best_x = None
+    for iteration in range(max_iterations):
+        start_time = time.perf_counter()
+        master.optimize()
+        info['master_time'] += time.perf_counter() - start_time
+        info['iterations'] = iteration + 1
+        if master.status != GRB.OPTIMAL:
+            print("No optimal solution found.")
+            return (None, None, None)
+        upper_bound = master.ObjVal
+        x_value = np.round(x.X)
+        theta_value = theta.X
+
+        # Solve the assembly of every scenario for the current x
+        start_time = time.perf_counter()
+        revenue = np.empty(num_scenarios)
+        mu = np.empty((num_scenarios, num_items))
+        pi = np.empty((num_scenarios, num_components))
+        for batch, (subproblem, y_sub, qty_products, gozinto_rows) in zip(batches, subproblems):
+            gozinto_rows.RHS = np.repeat(x_value, len(batch))
+            subproblem.optimize()
+            revenue[batch] = price @ y_sub.X
+            mu[batch] = qty_products.Pi.reshape(num_items, len(batch)).T
+            pi[batch] = gozinto_rows.Pi.reshape(num_components, len(batch)).T
+        info['subproblem_time'] += time.perf_counter() - start_time
+
+        value = prob @ revenue - cost @ x_value
+        if value > best_value:
+            best_value, best_x = value, x_value
+        info['upper_bound'] = upper_bound
+        info['gap'] = (upper_bound - best_value) / max(1.0, abs(upper_bound))
+        if info['gap'] <= gap:
+            break
+
+        # Optimality cuts theta[s] - pi[s] @ x <= demand[s] @ mu[s] for the scenarios overestimated by the master
+        violated = np.flatnonzero(theta_value > revenue + 1e-6 * np.maximum(1.0, np.abs(revenue)))
+        if len(violated) == 0:
+            break
+        num_cuts = len(violated)
+        cuts = sp.hstack([
+            -sp.csr_matrix(pi[violated]),
+            sp.csr_matrix((np.ones(num_cuts), (np.arange(num_cuts), violated)), shape=(num_cuts, num_scenarios))
+        ], format='csr')
+        master.addMConstr(cuts, x.tolist() + theta.tolist(), '<', (mu[violated] * demand[violated]).sum(axis=1), name=f"cut_{iteration}")
+        x.Start = best_x
+        info['cuts'] += num_cuts
+
+    if not return_model:
+        return (best_value, best_x, info)
+
+    # Extensive form with the components fixed at the best solution: the scenarios are independent
+    (model_stochastic, y, x) = build_model_variables(df1 = df1, products_price = products_price, machine_daily_time = machine_daily_time, demand = demand, prob = prob, threads = threads)
+    x.LB = best_x
+    x.UB = best_x
+    model_stochastic._benders_info = info
+    model_stochastic.optimize()
     if model_stochastic.status == GRB.OPTIMAL:
         return (model_stochastic, y, x)
     else:
         print("No optimal solution found.")
         return (None, None, None)
 
-def gurobi_model(df1:pd.DataFrame = None, products_price:dict = None, machine_daily_time:dict = None, demand:list = None, prob:list = None, path:str = None):
-    (model_stochastic, y, x) = gurobi_model_variables(df1 = df1, products_price = products_price, machine_daily_time = machine_daily_time, demand = demand, prob = prob, path = path)
-    return model_stochastic
-    
-def get_data(path:str = None):
+def _assembly_subproblem(gozinto:np.ndarray, price:np.ndarray, demand:np.ndarray, threads:int = None):
+    #
+    # This function creates the assembly LP of a batch of scenarios for a fixed number of components,
+    # which is the right-hand side of the gozinto rows (initially 0)
+    #
+    # OUTPUT:
+    # subproblem: gurobi model, y: MVar (n_products, n_batch), qty_products and gozinto: MConstr with rows ordered as y.reshape(-1)
+    num_components, num_items = gozinto.shape
+    num_batch = len(demand)
+    subproblem = gp.Model("ato_assembly")
+    subproblem.setParam('OutputFlag', 0)
+    set_parameters(subproblem, threads)
+    y = subproblem.addMVar((num_items, num_batch), obj=np.outer(price, np.ones(num_batch)), name="y")
+    subproblem.ModelSense = GRB.MAXIMIZE
+    qty_products = subproblem.addMConstr(sp.identity(num_items*num_batch, format='csr'), y.reshape(-1), '<', demand.T.reshape(-1), name="qty_products")
+    gozinto_rows = subproblem.addMConstr(sp.kron(sp.csr_matrix(gozinto), sp.identity(num_batch), format='csr'), y.reshape(-1), '<', np.zeros(num_components*num_batch), name="gozinto")
+    return subproblem, y, qty_products, gozinto_rows
+
+def evaluate_first_stage(x:np.ndarray, demand:np.ndarray, df1:pd.DataFrame = None, products_price:dict = None, machine_daily_time:dict = None, prob:list = None, path:str = None, integer:bool = False, batch_size:int = 100000):
+    #
+    # This function computes the expected profit of a fixed number of components x on a (large) sample of demand scenarios
+    # For a fixed x the second stage of every scenario is the assembly problem max price @ y, y <= demand[s], gozinto @ y <= x.
+    # Its LP relaxation is evaluated by bunching: the optimal basis of the assembly LP does not depend on the demand
+    # (only its primal feasibility does), so the solution given by a basis is computed with NumPy for all the
+    # scenarios of a batch at once and gurobi is called only to find a new basis for the scenarios where it is not feasible.
+    # Identical demand vectors are evaluated once.
+    #
+    # INPUTS:
+    # x: array (n_components,) with the number of each component
+    # demand: array (n_scenarios, n_products) with the demand of each product in each scenario,
+    #   or an iterator of such arrays (e.g. ScenarioGenerator.batches) with equally likely scenarios,
+    #   which are evaluated one batch at a time without keeping the whole sample in memory
+    # df1, products_price, machine_daily_time, path: as in gurobi_model_variables
+    # prob: list with the probability of each scenario, if None the scenarios are equally likely (not used with an iterator)
+    # integer: if True the assembly is an integer program, the scenarios with a fractional LP solution
+    #   are re-solved with a single reusable integer model
+    # batch_size: number of scenarios evaluated together
+    #
+    # OUTPUT:
+    # expected_profit: expected revenue - cost of the components
+    # revenue: array (n_scenarios,) with the revenue of each scenario
+
+    if df1 is None:
+        df1, products_price, machine_daily_time, products, num_components, num_items, num_machines = get_data(path = path)
+
+    processing_time, gozinto, cost, price, machine_time = get_model_arrays(df1, products_price, machine_daily_time)
+    num_components, num_items = gozinto.shape
+    x = np.asarray(x, dtype=float)
+    if isinstance(demand, Iterator):
+        batches = (np.asarray(batch, dtype=float).reshape(-1, num_items) for batch in demand)
+        prob = None
+    else:
+        demand, prob = get_scenarios(demand, prob, num_items)
+        batches = (demand[first:first + batch_size] for first in range(0, len(demand), batch_size))
+
+    # Assembly LP of a single scenario for the fixed x, the demand is the upper bound of y
+    assembly = gp.Model("ato_assembly")
+    assembly.setParam('OutputFlag', 0)
+    assembly.setParam('Method', 1)
+    y = assembly.addMVar(num_items, ub=0.0, obj=price, name="y")
+    assembly.ModelSense = GRB.MAXIMIZE
+    gozinto_rows = assembly.addMConstr(gozinto, y, '<', x, name="gozinto")
+    if integer:
+        assembly_integer = gp.Model("ato_assembly_integer")
+        assembly_integer.setParam('OutputFlag', 0)
+        y_integer = assembly_integer.addMVar(num_items, ub=0.0, vtype=GRB.INTEGER, obj=price, name="y")
+        assembly_integer.ModelSense = GRB.MAXIMIZE
+        assembly_integer.addMConstr(gozinto, y_integer, '<', x, name="gozinto")
+
+    revenue = []
+    for batch in batches:
+        unique_demand, inverse = np.unique(batch, axis=0, return_inverse=True)
+        y_value = _assembly_bunching(unique_demand, x, gozinto, assembly, y, gozinto_rows)
+        if integer:
+            for s in np.flatnonzero((np.abs(y_value - np.round(y_value)) > 1e-6).any(axis=1)):
+                y_integer.UB = unique_demand[s]
+                assembly_integer.optimize()
+                y_value[s] = y_integer.X
+        revenue.append((y_value @ price)[inverse.reshape(-1)])
+    revenue = np.concatenate(revenue)
+
+    expected_revenue = revenue.mean() if prob is None else prob @ revenue
+    return (expected_revenue - cost @ x, revenue)
+
+def _assembly_bunching(demand:np.ndarray, x:np.ndarray, gozinto:np.ndarray, assembly, y, gozinto_rows, tol:float = 1e-6):
+    #
+    # This function solves the assembly LP of all the scenarios in demand reusing the optimal bases found by gurobi
+    # OUTPUT: y_value array (n_scenarios, n_products) with the optimal production of each scenario
+    #
+    y_value = np.empty(demand.shape)
+    unresolved = np.arange(len(demand))
+    while len(unresolved) > 0:
+        # New basis from the first scenario not yet solved
+        y.UB = demand[unresolved[0]]
+        assembly.optimize()
+        free = y.VBasis == 0
+        at_upper = y.VBasis == -2
+        tight = gozinto_rows.CBasis != 0
+
+        # Solution of the basis for the remaining scenarios: the basic y solve the tight gozinto rows
+        batch = demand[unresolved]
+        y_batch = np.zeros(batch.shape)
+        y_batch[:, at_upper] = batch[:, at_upper]
+        if free.any():
+            rhs = x[tight] - batch[:, at_upper] @ gozinto[np.ix_(tight, at_upper)].T
+            y_batch[:, free] = np.linalg.solve(gozinto[np.ix_(tight, free)], rhs.T).T
+        feasible = (y_batch >= -tol).all(axis=1) & (y_batch <= batch + tol).all(axis=1) & (y_batch @ gozinto.T <= x + tol).all(axis=1)
+        feasible[0] = True
+        y_batch[0] = y.X
+
+        y_value[unresolved[feasible]] = y_batch[feasible]
+        unresolved = unresolved[~feasible]
+    return y_value
+
+def get_data(path:str = None, reload:bool = False):
     # This function reads the data from the csv files
+    # If the data has been compiled with compile_data (and the csv files have not changed since then)
+    # the compiled arrays are memory-mapped instead of parsing the csv files.
+    # The data is read only once per process: the next calls return the same dataframe, unless reload is True
+    # ATTENTION: the dataframe is shared between the calls and must not be modified
     if path is None:
         file_path = 'data/'
     else:
         file_path = f'{path}data/'
+    if reload or file_path not in _data_cache:
+        if _compiled_is_current(file_path):
+            _data_cache[file_path] = _load_compiled_data(file_path)
+        else:
+            _data_cache[file_path] = _read_csv_data(file_path)
+    df1, products_price, machine_daily_time, products, num_components, num_items, num_machines = _data_cache[file_path]
+    return df1, dict(products_price), dict(machine_daily_time), list(products), num_components, num_items, num_machines
+
+def compile_data(path:str = None, sparse:bool = None):
+    #
+    # This function converts the csv files of the data folder in the compiled format read by get_data:
+    # the folder data/compiled contains values.npy, the (n_components, n_machines + n_products + 1) array with the
+    # processing times, the gozinto factors and the costs, and metadata.json with the names of the components and
+    # of the columns, the price of each product and the daily time of each machine
+    # sparse: if True the array is stored as a CSR matrix in values.npz and get_data returns a dataframe with sparse
+    #   columns; if None it is stored sparse when less than 10% of the values are not zero
+    #
+    if path is None:
+        file_path = 'data/'
+    else:
+        file_path = f'{path}data/'
+    df1, products_price, machine_daily_time, products, num_components, num_items, num_machines = _read_csv_data(file_path)
+    os.makedirs(f'{file_path}compiled', exist_ok=True)
+    values = df1.to_numpy(dtype=float)
+    if sparse is None:
+        sparse = np.count_nonzero(values) < 0.1 * values.size
+    if sparse:
+        sp.save_npz(f'{file_path}compiled/values.npz', sp.csr_matrix(values))
+    else:
+        np.save(f'{file_path}compiled/values.npy', values)
+    metadata = {
+        'format': 'sparse' if sparse else 'dense',
+        'components': list(df1.index),
+        'columns': list(df1.columns),
+        'products_price': products_price,
+        'machine_daily_time': machine_daily_time,
+    }
+    with open(f'{file_path}compiled/metadata.json', 'w') as f:
+        json.dump(metadata, f)
+    _data_cache.pop(file_path, None)
+
+_data_cache = {}
+
+def _read_csv_data(file_path:str):
     df1 = pd.read_csv(f'{file_path}components_data.csv', index_col=0)
     with open(f'{file_path}products_machines.csv', 'r') as f:
         reader = csv.reader(f)
@@ -112,3 +771,197 @@ def get_data(path:str = None):
     num_components = len(df1)
     products = list(products_price.keys())
     return df1, products_price, machine_daily_time, products, num_components, num_items, num_machines
+
+def _compiled_is_current(file_path:str):
+    # True if the compiled data exists and is newer than the csv files
+    compiled = f'{file_path}compiled/metadata.json'
+    if not os.path.exists(compiled):
+        return False
+    compiled_time = os.path.getmtime(compiled)
+    return all(os.path.getmtime(f'{file_path}{name}') <= compiled_time for name in ['components_data.csv', 'products_machines.csv'])
+
+def _load_compiled_data(file_path:str):
+    with open(f'{file_path}compiled/metadata.json', 'r') as f:
+        metadata = json.load(f)
+    if metadata.get('format') == 'sparse':
+        values = sp.load_npz(f'{file_path}compiled/values.npz')
+        df1 = pd.DataFrame.sparse.from_spmatrix(values, index=metadata['components'], columns=metadata['columns']).astype(pd.SparseDtype(float, 0))
+    else:
+        values = np.load(f'{file_path}compiled/values.npy', mmap_mode='r')
+        df1 = pd.DataFrame(values, index=metadata['components'], columns=metadata['columns'], copy=False)
+    products_price = metadata['products_price']
+    machine_daily_time = metadata['machine_daily_time']
+    products = list(products_price.keys())
+    return df1, products_price, machine_daily_time, products, len(df1), len(products_price), len(machine_daily_time)
+
+def get_model_arrays(df1:pd.DataFrame, products_price:dict, machine_daily_time:dict, sparse:bool = False):
+    #
+    # This function extracts once the numerical blocks of the data used to build the model
+    #
+    # INPUTS:
+    # df1, products_price, machine_daily_time: as in gurobi_model_variables
+    #   df1 can have sparse columns (e.g. the compiled data of a sparse instance): in this case it is never converted to a dense array
+    # sparse: if True processing_time and gozinto are scipy CSR matrices with only the non-zero entries
+    #
+    # OUTPUT:
+    # processing_time: array (n_components, n_machines) with the time in minutes that each component takes in each machine
+    # gozinto: array (n_components, n_products) with the gozinto factors
+    # cost: array (n_components,) with the fixed cost of each component
+    # price: array (n_products,) with the selling price of each product
+    # machine_time: array (n_machines,) with the daily time in minutes available for each machine
+    num_machines = len(machine_daily_time)
+    num_items = len(products_price)
+    if all(isinstance(dtype, pd.SparseDtype) for dtype in df1.dtypes):
+        values = df1.sparse.to_coo().tocsc().astype(float)
+        processing_time = values[:, :num_machines].tocsr()
+        gozinto = values[:, num_machines:num_machines + num_items].tocsr()
+        cost = values[:, -1].toarray().ravel()
+        if not sparse:
+            processing_time = processing_time.toarray()
+            gozinto = gozinto.toarray()
+    else:
+        values = df1.to_numpy(dtype=float)
+        processing_time = values[:, :num_machines]
+        gozinto = values[:, num_machines:num_machines + num_items]
+        cost = values[:, -1]
+        if sparse:
+            processing_time = sp.csr_matrix(processing_time)
+            gozinto = sp.csr_matrix(gozinto)
+    price = np.fromiter(products_price.values(), dtype=float, count=num_items)
+    machine_time = np.fromiter(machine_daily_time.values(), dtype=float, count=num_machines)
+    return processing_time, gozinto, cost, price, machine_time
+
+def get_scenarios(demand:list, prob:list, num_items:int):
+    #
+    # This function returns the demand scenarios and their probabilities as arrays
+    # when demand is None a single scenario is sampled, when prob is None the scenarios are equally likely
+    #
+    # OUTPUT:
+    # demand: array (n_scenarios, n_products)
+    # prob: array (n_scenarios,)
+    if demand is None:
+        demand = legacy_normal_demand(42, 1, num_items)
+        prob = [1]
+    else:
+        if prob is None:
+            prob = [1/len(demand)]*len(demand)
+    num_scenarios = len(demand)
+    demand = np.asarray(demand, dtype=float).reshape(num_scenarios, num_items)
+    prob = np.asarray(prob, dtype=float)
+    return demand, prob
+
+class ScenarioModel:
+    #
+    # This class keeps a gurobi model of the ATO problem that grows scenario by scenario.
+    # The first-stage variables x and the working_hours constraints are created once; every call
+    # to add_scenarios only appends the y variables and the qty_products / gozinto rows of the
+    # new scenarios and re-weights the probabilities in the objective.
+    # Each optimize() is warm-started with the previous solution (the new scenarios start at y = 0,
+    # which is always feasible for the previous x).
+    #
+    # INPUTS:
+    # df1, products_price, machine_daily_time, path, aggregate_gozinto: as in gurobi_model_variables
+    #
+    # ATTRIBUTES:
+    # model: gurobi model
+    # x: MVar (n_components,) with the number of each component
+    # y: list of MVar (n_products, n_new_scenarios), one for each call to add_scenarios
+    # demand: array (n_scenarios, n_products) with the demand of the scenarios added so far
+    # prob: array (n_scenarios,) with the probability of each scenario
+    #
+    def __init__(self, df1:pd.DataFrame = None, products_price:dict = None, machine_daily_time:dict = None, path:str = None, aggregate_gozinto:bool = True):
+        if df1 is None:
+            df1, products_price, machine_daily_time, products, num_components, num_items, num_machines = get_data(path = path)
+        self.processing_time, self.gozinto, self.cost, self.price, self.machine_time = get_model_arrays(df1, products_price, machine_daily_time, sparse = True)
+        self.num_components, self.num_items = self.gozinto.shape
+
+        self.model = gp.Model("ato")
+        self.model.setParam('OutputFlag', 0)
+        self.x = self.model.addMVar(self.num_components, vtype=GRB.INTEGER, obj=-self.cost, name="x")
+        self.model.ModelSense = GRB.MAXIMIZE
+        self.model.addMConstr(self.processing_time.T, self.x, '<', self.machine_time*7, name="working_hours")
+
+        # The gozinto rows of every scenario bound the products with the capacity variables: x or, when the components
+        # are grouped by gozinto signature, the z of the groups (created once, as in build_model_variables)
+        signatures, linking = group_gozinto_signatures(self.gozinto) if aggregate_gozinto else (None, None)
+        if signatures is None:
+            self.gozinto_sparse, self.capacity = sp.csr_matrix(self.gozinto), self.x.tolist()
+        else:
+            z = self.model.addMVar(signatures.shape[0], name="z")
+            self.model.addMConstr(linking, z.tolist() + self.x.tolist(), '<', np.zeros(linking.shape[0]), name="gozinto_groups")
+            self.gozinto_sparse, self.capacity = signatures, z.tolist()
+
+        self.y = []
+        self.demand = np.zeros((0, self.num_items))
+        self.prob = np.zeros(0)
+        self._solution = None
+
+    @property
+    def num_scenarios(self):
+        return len(self.demand)
+
+    @property
+    def objVal(self):
+        return self.model.ObjVal
+
+    @property
+    def status(self):
+        return self.model.status
+
+    def add_scenarios(self, demand, prob:list = None):
+        #
+        # Appends the scenarios in demand (array n_new_scenarios x n_products) to the model.
+        # prob: probability of every scenario (old and new); if None all the scenarios are equally likely
+        #
+        demand = np.asarray(demand, dtype=float).reshape(-1, self.num_items)
+        num_new = len(demand)
+        if num_new == 0:
+            return
+        block = len(self.y)
+
+        y = self.model.addMVar((self.num_items, num_new), vtype=GRB.INTEGER, name=f"y_{block}")
+        self.model.addMConstr(sp.identity(self.num_items*num_new, format='csr'), y.reshape(-1), '<', demand.T.reshape(-1), name=f"qty_products_{block}")
+        gozinto_matrix = sp.hstack([
+            sp.kron(self.gozinto_sparse, sp.identity(num_new)),
+            -sp.kron(sp.identity(len(self.capacity)), np.ones((num_new, 1)))
+        ], format='csr')
+        self.model.addMConstr(gozinto_matrix, y.reshape(-1).tolist() + self.capacity, '<', np.zeros(len(self.capacity)*num_new), name=f"gozinto_{block}")
+
+        self.model.update()
+        self.y.append(y)
+        self.demand = np.vstack([self.demand, demand])
+        if prob is None:
+            prob = np.full(self.num_scenarios, 1/self.num_scenarios)
+        self.set_prob(prob)
+
+    def set_prob(self, prob:list):
+        # Re-weights the expected revenue of every scenario in the objective
+        self.prob = np.asarray(prob, dtype=float)
+        first = 0
+        for y in self.y:
+            num_block = y.shape[1]
+            y.Obj = np.outer(self.price, self.prob[first:first + num_block])
+            first += num_block
+
+    def optimize(self, recorder = None, accept_gap:float = None, **info):
+        #
+        # Optimizes the model starting from the previous solution, if any.
+        # recorder: instrumentation.SolveRecorder where the statistics of the solve are recorded (with info), None to record nothing
+        # accept_gap: as in gurobi_model_variables, the parameters TimeLimit, MIPGap and Threads are set on self.model
+        # OUTPUT: True if an optimal solution (or an incumbent within accept_gap) is found, False otherwise
+        #
+        if self._solution is not None:
+            x_start, y_start = self._solution
+            self.x.Start = x_start
+            for k, y in enumerate(self.y):
+                y.Start = y_start[k] if k < len(y_start) else np.zeros(y.shape)
+        if recorder is None:
+            self.model.optimize()
+        else:
+            recorder.optimize(self.model, n_scenarios = self.num_scenarios, **info)
+
+        if is_acceptable(self.model, accept_gap):
+            self._solution = (self.x.X, [y.X for y in self.y])
+            return True
+        print("No optimal solution found.")
+        return False
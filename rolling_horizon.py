@@ -0,0 +1,180 @@
+import time
+import pandas as pd # type: ignore
+import numpy as np # type: ignore
+import scipy.sparse as sp # type: ignore
+from model import gp, GRB, get_data, get_model_arrays, set_parameters # type: ignore
+from scenarios import ScenarioGenerator # type: ignore
+
+class RollingHorizon:
+    #
+    # This class re-plans the ATO problem every period (week) over a sliding window of n_periods periods.
+    # The multi-period model is built once: in every period t of the window the components x[i, t] are bought
+    # within the working_hours of the period, and the products y[j, t, s] of each scenario s (a trajectory of
+    # the demand over the whole window) are assembled from the inventory of components, that is carried
+    # from a period to the next one:
+    #   I[i, t, s] = I[i, t-1, s] + x[i, t] - sum_j gozinto[i, j] * y[j, t, s] >= 0,   I[i, -1, s] = initial inventory
+    # and the objective is the expected revenue minus the cost of the components and the holding cost of the inventory.
+    # At every roll only the decisions of the first period are implemented: the realized demand of the period is
+    # served (most expensive products first) and the inventory left becomes the initial inventory of the next window.
+    # The window is rolled by changing in place the bounds of y (new demand scenarios), the right hand side of
+    # the inventory balance (initial inventory) and of the working_hours constraints, and the solve is
+    # warm-started with the solution of the previous roll shifted by one period.
+    #
+    # INPUTS:
+    # df1, products_price, machine_daily_time, path: as in gurobi_model_variables
+    # n_periods: number of periods of the window
+    # n_scenarios: number of demand scenarios of the window sampled at every roll
+    # generator: scenarios.ScenarioGenerator of the demand of a period, its stream 0 gives the scenarios of the windows
+    #   and its stream 1 the realized demand (when it is not given to roll); None for the default normal demand with seed 0
+    # holding_cost: cost of keeping a component in inventory for one period (scalar or array (n_components,))
+    # initial_inventory: array (n_components,) with the components available before the first period, None for no inventory
+    # working_days: number of working days of a period, the working_hours are machine_daily_time * working_days
+    # threads, time_limit, mip_gap: as in gurobi_model_variables, for every roll
+    #
+    # ATTRIBUTES:
+    # model: gurobi model, x: MVar (n_components, n_periods), y: MVar (n_products, n_periods, n_scenarios),
+    # inventory: MVar (n_components, n_periods, n_scenarios)
+    # initial_inventory: array (n_components,) with the inventory at the start of the next roll
+    # build_time: time in seconds spent to build the model
+    #
+    def __init__(self, df1:pd.DataFrame = None, products_price:dict = None, machine_daily_time:dict = None, path:str = None, n_periods:int = 12, n_scenarios:int = 10, generator:ScenarioGenerator = None, holding_cost = 0.0, initial_inventory:np.ndarray = None, working_days:float = 7, threads:int = None, time_limit:float = None, mip_gap:float = None):
+        if df1 is None:
+            df1, products_price, machine_daily_time, products, num_components, num_items, num_machines = get_data(path = path)
+        start_time = time.perf_counter()
+        self.processing_time, gozinto, self.cost, self.price, self.machine_time = get_model_arrays(df1, products_price, machine_daily_time, sparse = True)
+        self.gozinto = sp.csc_matrix(gozinto)
+        self.num_components, self.num_items = self.gozinto.shape
+        self.n_periods = n_periods
+        self.n_scenarios = n_scenarios
+        self.working_days = working_days
+        self.components = list(df1.index)
+        if generator is None:
+            generator = ScenarioGenerator(self.num_items, seed=0)
+        self.forecast = generator.stream(0)
+        self.realized = generator.stream(1)
+        self.holding_cost = np.broadcast_to(np.asarray(holding_cost, dtype=float), (self.num_components,))
+        self.initial_inventory = np.zeros(self.num_components) if initial_inventory is None else np.asarray(initial_inventory, dtype=float)
+        self.rolls = 0
+        self._x_value = None
+        prob = np.full(n_scenarios, 1/n_scenarios)
+
+        self.model = gp.Model("ato_rolling")
+        self.model.setParam('OutputFlag', 0)
+        set_parameters(self.model, threads, time_limit, mip_gap)
+        # x[i, t] components bought in period t, y[j, t, s] products assembled in period t of scenario s,
+        # inventory[i, t, s] components left at the end of period t of scenario s
+        self.x = self.model.addMVar((self.num_components, n_periods), vtype=GRB.INTEGER, obj=np.repeat(-self.cost[:, None], n_periods, axis=1), name="x")
+        self.y = self.model.addMVar((self.num_items, n_periods, n_scenarios), vtype=GRB.INTEGER, ub=0.0,
+                                    obj=np.broadcast_to(self.price[:, None, None] * prob, (self.num_items, n_periods, n_scenarios)), name="y")
+        self.inventory = self.model.addMVar((self.num_components, n_periods, n_scenarios),
+                                            obj=np.broadcast_to(-self.holding_cost[:, None, None] * prob, (self.num_components, n_periods, n_scenarios)), name="inventory")
+        self.model.ModelSense = GRB.MAXIMIZE
+
+        # Constraint 1: working hours of every machine in every period, row m*n_periods + t
+        self.working_hours = self.model.addMConstr(sp.kron(sp.csr_matrix(self.processing_time.T), sp.identity(n_periods), format='csr'), self.x.reshape(-1), '<',
+                                                   np.repeat(self.machine_time * working_days, n_periods), name="working_hours")
+
+        # Constraint 2: inventory balance, row (i*n_periods + t)*n_scenarios + s
+        # inventory[i, t, s] - inventory[i, t-1, s] - x[i, t] + sum_j gozinto[i, j] * y[j, t, s] = initial_inventory[i] if t == 0 else 0
+        # (the demand is the upper bound of y, that is changed at every roll)
+        window = n_periods * n_scenarios
+        balance = sp.hstack([
+            sp.kron(sp.identity(self.num_components), sp.kron(sp.identity(n_periods) - sp.eye(n_periods, k=-1), sp.identity(n_scenarios))),
+            -sp.kron(sp.identity(self.num_components * n_periods), np.ones((n_scenarios, 1))),
+            sp.kron(self.gozinto, sp.identity(window))
+        ], format='csr')
+        self.balance = self.model.addMConstr(balance, self.inventory.reshape(-1).tolist() + self.x.reshape(-1).tolist() + self.y.reshape(-1).tolist(), '=',
+                                             self._balance_rhs(), name="inventory_balance")
+        self.model.update()
+        self.build_time = time.perf_counter() - start_time
+
+    def roll(self, realized_demand:np.ndarray = None, machine_daily_time:np.ndarray = None):
+        #
+        # This function samples the demand scenarios of the window, solves the model and implements its first period
+        #
+        # INPUTS:
+        # realized_demand: array (n_products,) with the demand of the first period, None to sample it from the generator
+        # machine_daily_time: array (n_machines,) or (n_periods, n_machines) with the daily time of the machines in the periods
+        #   of the window, None for the one of the data (also after a roll with a different machine_daily_time)
+        #
+        # OUTPUT:
+        # dictionary with the statistics of the roll: status and objVal of the solve, update_time (seconds to change the model),
+        # runtime (seconds of gurobi), roll_time (total seconds of the roll), revenue, cost and holding_cost of the first period
+        # and the number x_<component> of each component bought in it
+        # ATTENTION: when no solution is found no component is bought in the first period
+        #
+        start_time = time.perf_counter()
+        demand = self.forecast.sample(self.n_scenarios * self.n_periods).reshape(self.n_scenarios, self.n_periods, self.num_items)
+        self.y.UB = demand.transpose(2, 1, 0)
+        self.balance.RHS = self._balance_rhs()
+        # without an override the capacity of the data is written again, so that the override of a previous roll does not persist
+        machine_time = self.machine_time if machine_daily_time is None else np.asarray(machine_daily_time, dtype=float)
+        machine_time = np.broadcast_to(machine_time, (self.n_periods, len(self.machine_time)))
+        self.working_hours.RHS = machine_time.T.reshape(-1) * self.working_days
+        if self._x_value is not None:
+            # the previous plan shifted by one period, the last period repeats the previous last one
+            self.x.Start = np.concatenate([self._x_value[:, 1:], self._x_value[:, -1:]], axis=1)
+        update_time = time.perf_counter() - start_time
+        self.model.optimize()
+
+        if self.model.SolCount > 0:
+            self._x_value = self.x.X
+            x_first = np.round(self._x_value[:, 0])
+            objVal = self.model.objVal
+        else:
+            self._x_value = None
+            x_first = np.zeros(self.num_components)
+            objVal = None
+        if realized_demand is None:
+            realized_demand = self.realized.sample(1)[0]
+        available = self.initial_inventory + x_first
+        y_realized = _assemble(available, self.gozinto, self.price, np.asarray(realized_demand, dtype=float))
+        self.initial_inventory = available - self.gozinto @ y_realized
+        self.rolls += 1
+
+        result = {'roll': self.rolls - 1, 'status': self.model.status, 'objVal': objVal, 'update_time': update_time,
+                  'runtime': self.model.Runtime, 'roll_time': time.perf_counter() - start_time,
+                  'revenue': self.price @ y_realized, 'cost': self.cost @ x_first, 'holding_cost': self.holding_cost @ self.initial_inventory}
+        result.update(zip([f'x_{component}' for component in self.components], x_first))
+        return result
+
+    def run(self, n_rolls:int, realized_demand:np.ndarray = None, machine_daily_time:np.ndarray = None):
+        #
+        # This function rolls the window n_rolls times
+        #
+        # INPUTS:
+        # realized_demand: array (n_rolls, n_products) with the realized demand of the periods, None to sample it
+        # machine_daily_time: as in roll, the same for every roll
+        #
+        # OUTPUT:
+        # dataframe with one row (the output of roll) for each roll
+        #
+        rows = [self.roll(None if realized_demand is None else realized_demand[k], machine_daily_time) for k in range(n_rolls)]
+        return pd.DataFrame(rows).set_index('roll')
+
+    def _balance_rhs(self):
+        rhs = np.zeros((self.num_components, self.n_periods, self.n_scenarios))
+        rhs[:, 0, :] = self.initial_inventory[:, None]
+        return rhs.reshape(-1)
+
+def _assemble(available:np.ndarray, gozinto:sp.csc_matrix, price:np.ndarray, demand:np.ndarray):
+    # Assembles the products of the demand with the available components, the most expensive products first
+    available = available.copy()
+    y = np.zeros(len(price))
+    for j in np.argsort(-price):
+        rows = gozinto.indices[gozinto.indptr[j]:gozinto.indptr[j + 1]]
+        factors = gozinto.data[gozinto.indptr[j]:gozinto.indptr[j + 1]]
+        positive = factors > 0
+        quantity = demand[j]
+        if positive.any():
+            quantity = min(quantity, np.floor(available[rows[positive]] / factors[positive]).min())
+        y[j] = max(quantity, 0)
+        available[rows] -= factors * y[j]
+    return y
+
+if __name__ == '__main__':
+    # 12-week window rolled for 8 weeks on the data of the 'data' folder
+    planner = RollingHorizon(n_periods=12, n_scenarios=5)
+    print(f'Model built in {planner.build_time:.3f} s')
+    table = planner.run(8)
+    print(table[['status', 'objVal', 'update_time', 'runtime', 'roll_time', 'revenue', 'cost']])
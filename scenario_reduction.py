@@ -0,0 +1,104 @@
+import numpy as np # type: ignore
+
+def reduce_scenarios(demand:np.ndarray, prob:list = None, n_target:int = None, method:str = 'fast_forward'):
+    #
+    # This function reduces the demand scenarios before the model is built
+    # The identical demand vectors are always merged (their probabilities are added), then if n_target is smaller
+    # than the number of distinct scenarios they are reduced to n_target scenarios with the chosen method.
+    #
+    # INPUTS:
+    # demand: array (n_scenarios, n_products) with the demand of each product in each scenario
+    # prob: list with the probability of each scenario, if None the scenarios are equally likely
+    # n_target: number of scenarios to keep, if None only the identical scenarios are merged
+    # method: 'merge' (only merge identical scenarios), 'fast_forward' (forward selection) or 'kmedoids'
+    #
+    # OUTPUT:
+    # reduced_demand: array (n_reduced, n_products)
+    # reduced_prob: array (n_reduced,) with the probability of each reduced scenario
+    # distance: Kantorovich distance between the original and the reduced distribution when every
+    #   scenario is moved to the one it is assigned to (it bounds the Wasserstein distance of the reduction)
+    # assignment: array (n_scenarios,) with the index of the reduced scenario of each original scenario
+    #
+    unique_demand, unique_prob, inverse = merge_identical_scenarios(demand, prob)
+    if method == 'merge' or n_target is None or n_target >= len(unique_demand):
+        return (unique_demand, unique_prob, 0.0, inverse)
+
+    if method == 'fast_forward':
+        selected = fast_forward_selection(unique_demand, unique_prob, n_target)
+    elif method == 'kmedoids':
+        selected = kmedoids_selection(unique_demand, unique_prob, n_target)
+    else:
+        raise ValueError(f"Unknown scenario reduction method '{method}'")
+
+    # Every scenario is moved to the closest selected one
+    distance_to_selected = _distance_matrix(unique_demand, unique_demand[selected])
+    closest = np.argmin(distance_to_selected, axis=1)
+    reduced_prob = np.bincount(closest, weights=unique_prob, minlength=len(selected))
+    distance = unique_prob @ distance_to_selected[np.arange(len(unique_demand)), closest]
+    return (unique_demand[selected], reduced_prob, distance, closest[inverse])
+
+def merge_identical_scenarios(demand:np.ndarray, prob:list = None):
+    #
+    # This function merges the identical demand vectors and adds their probabilities
+    #
+    # OUTPUT:
+    # unique_demand: array (n_unique, n_products), unique_prob: array (n_unique,)
+    # inverse: array (n_scenarios,) with the index of the unique scenario of each original scenario
+    #
+    demand = np.asarray(demand)
+    if prob is None:
+        prob = np.full(len(demand), 1/len(demand))
+    unique_demand, inverse = np.unique(demand, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    unique_prob = np.bincount(inverse, weights=np.asarray(prob, dtype=float), minlength=len(unique_demand))
+    return (unique_demand, unique_prob, inverse)
+
+def fast_forward_selection(demand:np.ndarray, prob:np.ndarray, n_target:int):
+    #
+    # This function selects n_target scenarios with the fast forward selection of Heitsch and Romisch:
+    # at every step the scenario that most reduces the Kantorovich distance to the original distribution is added
+    # ATTENTION: the distance matrix of the scenarios is kept in memory (n_scenarios^2 values)
+    #
+    # OUTPUT: array (n_target,) with the indices of the selected scenarios
+    #
+    cost = _distance_matrix(demand, demand)
+    remaining = np.ones(len(demand), dtype=bool)
+    selected = []
+    for step in range(n_target):
+        candidates = np.flatnonzero(remaining)
+        # z[u] = sum over the remaining scenarios k != u of prob[k] * cost[k, u]
+        z = prob[candidates] @ cost[np.ix_(candidates, candidates)]
+        u = candidates[np.argmin(z)]
+        selected.append(u)
+        remaining[u] = False
+        # cost[k, l] becomes the distance of k from the closest between l and the selected scenarios
+        cost = np.minimum(cost, cost[:, [u]])
+    return np.array(selected)
+
+def kmedoids_selection(demand:np.ndarray, prob:np.ndarray, n_target:int, max_iterations:int = 100):
+    #
+    # This function selects n_target scenarios with a probability-weighted k-medoids,
+    # starting from the fast forward selection
+    #
+    # OUTPUT: array (n_target,) with the indices of the selected scenarios (the medoids)
+    #
+    distance = _distance_matrix(demand, demand)
+    medoids = fast_forward_selection(demand, prob, n_target)
+    for iteration in range(max_iterations):
+        cluster = np.argmin(distance[:, medoids], axis=1)
+        new_medoids = medoids.copy()
+        for k in range(n_target):
+            members = np.flatnonzero(cluster == k)
+            # the new medoid minimizes the weighted distance from the members of the cluster
+            new_medoids[k] = members[np.argmin(prob[members] @ distance[np.ix_(members, members)])]
+        if np.array_equal(new_medoids, medoids):
+            break
+        medoids = new_medoids
+    return medoids
+
+def _distance_matrix(a:np.ndarray, b:np.ndarray):
+    # Euclidean distance between every row of a and every row of b
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    squared = (a**2).sum(axis=1)[:, None] + (b**2).sum(axis=1)[None, :] - 2 * a @ b.T
+    return np.sqrt(np.maximum(squared, 0))
@@ -0,0 +1,168 @@
+import warnings
+import numpy as np # type: ignore
+from scipy import stats # type: ignore
+from scipy.stats import qmc # type: ignore
+
+DISTRIBUTIONS = ('normal', 'poisson', 'lognormal', 'multivariate_normal', 'empirical')
+SAMPLINGS = ('mc', 'antithetic', 'sobol')
+
+class ScenarioGenerator:
+    #
+    # This class samples demand scenarios of the ATO problem with a numpy.random.Generator
+    # The demand is rounded down to integers and clipped at 0 as in the rest of the project.
+    # Independent streams of scenarios (e.g. the samples S1 and S2 of the stability analysis) are obtained
+    # with stream(key), which derives a child of the SeedSequence of the generator: the same seed and key
+    # always give the same scenarios, in any process and in any order.
+    #
+    # INPUTS:
+    # num_items: number of products
+    # distribution: 'normal', 'poisson', 'lognormal', 'multivariate_normal' or 'empirical'
+    # seed: entropy of the SeedSequence (int or None for a random one)
+    # sampling: 'mc' (plain Monte Carlo), 'antithetic' (pairs of scenarios from u and 1 - u)
+    #   or 'sobol' (scrambled Sobol sequence, quasi-Monte Carlo)
+    # loc: mean of the demand of each product (scalar or array (n_products,)), not used by 'empirical'
+    # scale: standard deviation of the demand of each product, used by 'normal' and 'lognormal'
+    # cov: covariance matrix (n_products, n_products), used by 'multivariate_normal'
+    # data: array (n_observations, n_products) with the observed demand, used by 'empirical' (bootstrap)
+    #
+    # ATTENTION: 'antithetic' and 'sobol' transform uniform numbers with the inverse of the marginal cdf,
+    #   for 'multivariate_normal' the correlation is then applied with the Cholesky factor of cov
+    #
+    def __init__(self, num_items:int, distribution:str = 'normal', seed:int = None, sampling:str = 'mc', loc = 100, scale = 40, cov:np.ndarray = None, data:np.ndarray = None):
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f"Unknown demand distribution '{distribution}'")
+        if sampling not in SAMPLINGS:
+            raise ValueError(f"Unknown sampling method '{sampling}'")
+        if distribution == 'multivariate_normal' and cov is None:
+            raise ValueError("The 'multivariate_normal' distribution needs the covariance matrix cov")
+        if distribution == 'empirical' and data is None:
+            raise ValueError("The 'empirical' distribution needs the observed demand data")
+        self.num_items = num_items
+        self.distribution = distribution
+        self.sampling = sampling
+        self.loc = np.broadcast_to(np.asarray(loc, dtype=float), (num_items,))
+        self.scale = np.broadcast_to(np.asarray(scale, dtype=float), (num_items,))
+        self.cov = None if cov is None else np.asarray(cov, dtype=float)
+        self.data = None if data is None else np.asarray(data).reshape(-1, num_items)
+        self.seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        self.rng = np.random.default_rng(self.seed_sequence)
+        self._sobol = None
+        self._antithetic = None
+
+    def stream(self, key:int):
+        # Returns a new ScenarioGenerator with the same distribution whose scenarios are independent from
+        # the ones of every other key (the key-th child of the SeedSequence of this generator)
+        seed_sequence = np.random.SeedSequence(self.seed_sequence.entropy, spawn_key=self.seed_sequence.spawn_key + (key,))
+        return ScenarioGenerator(self.num_items, self.distribution, seed_sequence, self.sampling, self.loc, self.scale, self.cov, self.data)
+
+    def spawn(self, n_streams:int):
+        # Returns n_streams independent ScenarioGenerator (streams 0, ..., n_streams - 1)
+        return [self.stream(key) for key in range(n_streams)]
+
+    def sample(self, n_scenario:int):
+        #
+        # Returns the next n_scenario scenarios of the generator, array (n_scenario, n_products) of integers
+        # Consecutive calls continue the same sequence, so sampling n1 and then n2 scenarios gives the same
+        # scenarios as sampling n1 + n2 of them at once.
+        #
+        if self.sampling == 'mc':
+            demand = self._draw(n_scenario)
+        else:
+            demand = self._from_uniform(self._uniform(n_scenario))
+        return np.clip(demand.astype(int), 0, None)
+
+    def batches(self, n_scenario:int, batch_size:int = 100000):
+        # Yields the next n_scenario scenarios in arrays of at most batch_size rows, the whole sample is never in memory
+        for first in range(0, n_scenario, batch_size):
+            yield self.sample(min(batch_size, n_scenario - first))
+
+    def _draw(self, n_scenario:int):
+        # Plain Monte Carlo sample with the samplers of numpy.random.Generator
+        size = (n_scenario, self.num_items)
+        if self.distribution == 'normal':
+            return self.rng.normal(self.loc, self.scale, size=size)
+        if self.distribution == 'poisson':
+            return self.rng.poisson(self.loc, size=size)
+        if self.distribution == 'lognormal':
+            mu, sigma = self._lognormal_parameters()
+            return self.rng.lognormal(mu, sigma, size=size)
+        if self.distribution == 'multivariate_normal':
+            return self.rng.multivariate_normal(self.loc, self.cov, size=n_scenario, method='cholesky')
+        return self.data[self.rng.integers(len(self.data), size=n_scenario)]
+
+    def _uniform(self, n_scenario:int):
+        # Uniform numbers in (0, 1) of the antithetic or Sobol sampling, array (n_scenario, n_dimensions)
+        dimensions = 1 if self.distribution == 'empirical' else self.num_items
+        if self.sampling == 'sobol':
+            if self._sobol is None:
+                self._sobol = qmc.Sobol(dimensions, scramble=True, seed=self.rng)
+            with warnings.catch_warnings():
+                # the balance properties of the sequence only hold for powers of 2, any size is accepted here
+                warnings.simplefilter('ignore', UserWarning)
+                u = self._sobol.random(n_scenario)
+        else:
+            # the scenario drawn from 1 - u of every pair is kept for the next call when n_scenario is odd
+            u = np.empty((n_scenario, dimensions))
+            first = 0
+            if self._antithetic is not None and n_scenario > 0:
+                u[0] = self._antithetic
+                self._antithetic = None
+                first = 1
+            n_pairs = (n_scenario - first + 1) // 2
+            half = self.rng.random((n_pairs, dimensions))
+            pairs = np.empty((2*n_pairs, dimensions))
+            pairs[0::2] = half
+            pairs[1::2] = 1 - half
+            u[first:] = pairs[:n_scenario - first]
+            if 2*n_pairs > n_scenario - first:
+                self._antithetic = pairs[-1]
+        # the inverse cdf of the normal is infinite in 0 and 1
+        return np.clip(u, 1e-12, 1 - 1e-12)
+
+    def _from_uniform(self, u:np.ndarray):
+        # Inverse transform of the uniform numbers in the demand of the distribution
+        if self.distribution == 'normal':
+            return self.loc + self.scale * stats.norm.ppf(u)
+        if self.distribution == 'poisson':
+            return stats.poisson.ppf(u, self.loc)
+        if self.distribution == 'lognormal':
+            mu, sigma = self._lognormal_parameters()
+            return np.exp(mu + sigma * stats.norm.ppf(u))
+        if self.distribution == 'multivariate_normal':
+            return self.loc + stats.norm.ppf(u) @ np.linalg.cholesky(self.cov).T
+        return self.data[np.minimum((u[:, 0] * len(self.data)).astype(int), len(self.data) - 1)]
+
+    def _lognormal_parameters(self):
+        # mu and sigma of the underlying normal such that the demand has mean loc and standard deviation scale
+        sigma2 = np.log(1 + (self.scale / self.loc)**2)
+        return (np.log(self.loc) - sigma2 / 2, np.sqrt(sigma2))
+
+def legacy_normal_demand(seed:int, n_scenario:int, num_items:int, loc:float = 100, scale:float = 40):
+    #
+    # This function returns the demand sampled as in the first version of the project,
+    # np.random.seed(seed) followed by np.random.normal, so that the published results can be reproduced
+    #
+    # OUTPUT: array (n_scenario, n_products) of integers
+    #
+    return LegacyStream(seed, num_items, loc, scale).sample(n_scenario)
+
+class LegacyStream:
+    #
+    # This class continues a legacy np.random.RandomState sample with the same interface of
+    # ScenarioGenerator.sample, it is used by the incremental stability analysis when no generator is given
+    #
+    def __init__(self, seed:int, num_items:int, loc:float = 100, scale:float = 40):
+        self.random_state = np.random.RandomState(seed)
+        self.num_items = num_items
+        self.loc = loc
+        self.scale = scale
+
+    def sample(self, n_scenario:int):
+        demand = self.random_state.normal(loc=self.loc, scale=self.scale, size=(n_scenario, self.num_items)).astype(int)
+        return np.clip(demand, 0, None)
+
+def scenario_stream(generator:ScenarioGenerator, key:int, num_items:int):
+    # Returns the stream key of the generator, or the legacy RandomState stream with seed key when generator is None
+    if generator is None:
+        return LegacyStream(key, num_items)
+    return generator.stream(key)
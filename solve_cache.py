@@ -0,0 +1,193 @@
+import hashlib
+import io
+import os
+import sqlite3
+import time
+import pandas as pd # type: ignore
+import numpy as np # type: ignore
+from model import read_solution, get_data, get_model_arrays, get_scenarios, build_model_variables # type: ignore
+from backends import ATOProblem, solve_problem # type: ignore
+
+class CachedSolution:
+    #
+    # This class is the solution of the ATO model stored in the cache
+    #
+    # ATTRIBUTES:
+    # objVal: objective value, None when no optimal solution is found
+    # status: gurobi status of the solve
+    # Runtime: time in seconds spent by gurobi when the model was solved
+    # x: array (n_components,) with the number of each component, None when no optimal solution is found
+    # y: array (n_products, n_scenarios) with the amount of each product produced in each scenario, None when no optimal solution is found
+    # from_cache: True if the solution has been read from the cache
+    #
+    def __init__(self, objVal:float, status:int, Runtime:float, x:np.ndarray, y:np.ndarray, from_cache:bool = False):
+        self.objVal = objVal
+        self.status = status
+        self.Runtime = Runtime
+        self.x = x
+        self.y = y
+        self.from_cache = from_cache
+
+class SolveCache:
+    #
+    # This class is a content-addressed cache of the solutions of the ATO model stored in a SQLite file
+    # The least recently used solutions are removed when there are more than max_entries of them
+    # or when they take more than max_bytes.
+    #
+    # INPUTS:
+    # path: path of the SQLite file
+    # max_entries: maximum number of stored solutions
+    # max_bytes: maximum size in bytes of the stored x and y arrays
+    #
+    # ATTENTION: the connection to the file stays open until close() is called (or the end of a 'with' block)
+    #
+    def __init__(self, path:str = '.ato_cache/solves.sqlite', max_entries:int = 10000, max_bytes:int = 512*2**20):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS solves (
+            key TEXT PRIMARY KEY, objVal REAL, status INTEGER, runtime REAL,
+            x BLOB, y BLOB, size INTEGER, last_access REAL)''')
+        self.connection.commit()
+
+    def get(self, key:str):
+        # Returns the CachedSolution stored with the given key, None if there is none
+        row = self.connection.execute('SELECT objVal, status, runtime, x, y FROM solves WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        self.connection.execute('UPDATE solves SET last_access = ? WHERE key = ?', (time.time(), key))
+        self.connection.commit()
+        objVal, status, runtime, x, y = row
+        return CachedSolution(objVal, status, runtime, _load_array(x), _load_array(y), from_cache=True)
+
+    def put(self, key:str, solution:CachedSolution):
+        # Stores the solution with the given key and removes the least recently used ones beyond the limits
+        x = _dump_array(solution.x)
+        y = _dump_array(solution.y)
+        size = len(x or b'') + len(y or b'')
+        self.connection.execute('INSERT OR REPLACE INTO solves VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                (key, solution.objVal, solution.status, solution.Runtime, x, y, size, time.time()))
+        self.evict()
+        self.connection.commit()
+
+    def evict(self):
+        # Removes the least recently used solutions beyond max_entries and max_bytes
+        rows = self.connection.execute('SELECT key, size FROM solves ORDER BY last_access DESC').fetchall()
+        sizes = np.cumsum([size for key, size in rows])
+        expired = [(key,) for k, (key, size) in enumerate(rows) if k >= self.max_entries or sizes[k] > self.max_bytes]
+        self.connection.executemany('DELETE FROM solves WHERE key = ?', expired)
+
+    def clear(self):
+        self.connection.execute('DELETE FROM solves')
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM solves').fetchone()[0]
+
+def cached_model_variables(df1:pd.DataFrame = None, products_price:dict = None, machine_daily_time:dict = None, demand:list = None, prob:list = None, path:str = None, cache:SolveCache = None, use_cache:bool = True, backend:str = 'gurobi', recorder = None, accept_gap:float = None, **params):
+    #
+    # This function solves the ATO problem as gurobi_model_variables, reading the solution from the cache
+    # when the same inputs have already been solved
+    #
+    # INPUTS:
+    # df1, products_price, machine_daily_time, demand, prob, path: as in gurobi_model_variables
+    # cache: SolveCache where the solutions are stored, if None the default one is opened and closed by this call
+    #   (to solve many models open the cache once and pass it)
+    # use_cache: if False the cache is bypassed (neither read nor written)
+    # backend: 'gurobi' or 'highs' (see backends.solve_problem), it is part of the key when it is not 'gurobi'
+    # recorder: instrumentation.SolveRecorder where the solves and the cache hits are recorded, None to record nothing
+    # accept_gap: as in gurobi_model_variables, the best incumbent of a solve stopped within accept_gap is stored
+    #   as the solution (its status is the one at which the solve stopped); it is part of the key when it is not None
+    # params: other arguments of build_model_variables (e.g. threads, reduction, time_limit, mip_gap, relaxation), they are part of the key.
+    #   With relaxation = 'round' the rounded solution is stored (see gurobi_model_variables)
+    #   With the 'highs' backend only threads, time_limit and mip_gap are used
+    #
+    # OUTPUT:
+    # solution: CachedSolution
+    #
+    if use_cache and cache is None:
+        with SolveCache() as cache:
+            return cached_model_variables(df1, products_price, machine_daily_time, demand, prob, path, cache, use_cache, backend, recorder, accept_gap, **params)
+    if df1 is None:
+        df1, products_price, machine_daily_time, products, num_components, num_items, num_machines = get_data(path = path)
+    arrays = get_model_arrays(df1, products_price, machine_daily_time)
+    demand, prob = get_scenarios(demand, prob, len(arrays[3]))
+    # the parameters left to their default (None) are not part of the key
+    key_params = {key: value for key, value in params.items() if value is not None}
+    if backend != 'gurobi':
+        key_params['backend'] = backend
+    if accept_gap is not None:
+        key_params['accept_gap'] = accept_gap
+
+    if use_cache:
+        key = hash_inputs(*arrays, demand, prob, **key_params)
+        solution = cache.get(key)
+        if solution is not None:
+            if recorder is not None:
+                recorder.add({'backend': backend, 'from_cache': True, 'status': solution.status, 'objVal': solution.objVal,
+                              'runtime': solution.Runtime, 'n_scenarios': len(demand)})
+            return solution
+
+    if backend == 'gurobi':
+        (model_stochastic, y, x) = build_model_variables(df1 = df1, products_price = products_price, machine_daily_time = machine_daily_time, demand = demand, prob = prob, **params)
+        if recorder is None:
+            model_stochastic.optimize()
+        else:
+            recorder.optimize(model_stochastic, n_scenarios = len(demand))
+        result = read_solution(model_stochastic, y, x, accept_gap)
+        acceptable = result is not None
+        if acceptable:
+            solution = CachedSolution(result.objVal, result.status, result.Runtime, result.x, result.y)
+        else:
+            print("No optimal solution found.")
+            solution = CachedSolution(None, model_stochastic.status, model_stochastic.Runtime, None, None)
+        model_stochastic.dispose()
+    else:
+        problem = ATOProblem(df1 = df1, products_price = products_price, machine_daily_time = machine_daily_time, demand = demand, prob = prob)
+        result = solve_problem(problem, backend, threads = params.get('threads'), time_limit = params.get('time_limit'), mip_gap = params.get('mip_gap'), recorder = recorder)
+        acceptable = result.is_acceptable(accept_gap)
+        if acceptable:
+            solution = CachedSolution(result.objVal, result.status, result.Runtime, result.x, result.y)
+        else:
+            print("No optimal solution found.")
+            solution = CachedSolution(None, result.status, result.Runtime, None, None)
+
+    # the failed solves (e.g. stopped by the time limit) are not stored, a later call with the same inputs solves them again
+    if use_cache and acceptable:
+        cache.put(key, solution)
+    return solution
+
+def hash_inputs(*arrays, **params):
+    # Returns the SHA-256 of the given arrays (shape, dtype and values) and of the parameters
+    digest = hashlib.sha256()
+    for array in arrays:
+        array = np.ascontiguousarray(array, dtype=float)
+        digest.update(str(array.shape).encode())
+        digest.update(array.tobytes())
+    digest.update(repr(sorted(params.items())).encode())
+    return digest.hexdigest()
+
+def _dump_array(array:np.ndarray):
+    if array is None:
+        return None
+    buffer = io.BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+    return buffer.getvalue()
+
+def _load_array(data:bytes):
+    if data is None:
+        return None
+    return np.load(io.BytesIO(data), allow_pickle=False)
@@ -0,0 +1,228 @@
+import asyncio
+import functools
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd # type: ignore
+import numpy as np # type: ignore
+from model import GRB, build_model_variables, read_solution, get_data, get_model_arrays, get_scenarios # type: ignore
+from backends import ProblemSolution, OPTIMAL, INFEASIBLE, UNBOUNDED, TIME_LIMIT, OTHER # type: ignore
+from solve_cache import hash_inputs # type: ignore
+
+# Seconds between two checks of the cancellation event in the gurobi callback (each check is a round trip to the manager process)
+CANCEL_CHECK_INTERVAL = 0.1
+
+class SolveService:
+    #
+    # This class is an asyncio front end of the solver of the ATO problem, for callers (e.g. a web planning tool)
+    # that cannot be blocked for the whole build and solve of the model:
+    # - await service.solve(...) builds and solves the model (as gurobi_model_variables) in a pool of max_workers processes,
+    #   the requests beyond max_workers wait in a queue
+    # - identical requests in flight (same data, scenarios and parameters) share the same solve
+    # - a request is cancelled when its task is cancelled or its deadline expires: the solve is stopped with
+    #   model.terminate() (or removed from the queue) when no other request is waiting for it
+    # - stats() returns the queue depth, the number of running solves and the percentiles of the latency of the requests
+    # It must be used in an 'async with' block (or started with start() and stopped with aclose(), or close() outside the event loop).
+    #
+    # INPUTS:
+    # max_workers: number of solver processes, i.e. maximum number of concurrent solves
+    # threads: value of the gurobi parameter Threads of every solve (None for the gurobi default)
+    # path: path to the data files, used when a request does not give df1
+    # solver: function solver(inputs, cancel) run in the worker processes, where inputs is the dictionary of the arguments of
+    #   build_model_variables (plus accept_gap) and cancel a multiprocessing Event set when the solve must stop;
+    #   None for solve_in_worker (a stub without gurobi, e.g. stub_solver, can be used to test the service locally)
+    # max_latencies: number of latencies of the last requests used for the percentiles
+    #
+    def __init__(self, max_workers:int = 2, threads:int = None, path:str = None, solver = None, max_latencies:int = 10000):
+        self.max_workers = max_workers
+        self.threads = threads
+        self.path = path
+        self.solver = solve_in_worker if solver is None else solver
+        self.latencies = deque(maxlen=max_latencies)
+        self.completed = 0
+        self.cancelled = 0
+        self.failed = 0
+        self._executor = None
+        self._manager = None
+        self._slots = None
+        self._in_flight = {}
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    def start(self):
+        # Starts the worker processes and the manager process of the cancellation events
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        self._manager = multiprocessing.Manager()
+        self._slots = asyncio.Semaphore(self.max_workers)
+
+    def close(self):
+        # Stops the running solves and the processes, blocking until the workers have returned
+        self._cancel_in_flight()
+        self._shutdown()
+
+    async def aclose(self):
+        # As close, but the processes are stopped in a thread so that the event loop is not blocked while the solves terminate
+        self._cancel_in_flight()
+        await asyncio.get_running_loop().run_in_executor(None, self._shutdown)
+
+    def _cancel_in_flight(self):
+        for request in list(self._in_flight.values()):
+            request.cancel_solve()
+
+    def _shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._manager.shutdown()
+
+    async def solve(self, df1:pd.DataFrame = None, products_price:dict = None, machine_daily_time:dict = None, demand:list = None, prob:list = None, deadline:float = None, **params):
+        #
+        # INPUTS:
+        # df1, products_price, machine_daily_time, demand, prob: as in gurobi_model_variables
+        # deadline: maximum time in seconds of the request (queue and solve), None for no deadline.
+        #   asyncio.TimeoutError is raised when it expires
+        # params: other arguments of gurobi_model_variables (e.g. time_limit, mip_gap, accept_gap, aggregate_gozinto)
+        #
+        # OUTPUT:
+        # solution: backends.ProblemSolution (objVal, x and y are None when no acceptable solution is found)
+        #
+        start_time = time.perf_counter()
+        if df1 is None:
+            df1, products_price, machine_daily_time, products, num_components, num_items, num_machines = get_data(path = self.path)
+        demand, prob = get_scenarios(demand, prob, len(products_price))
+        params = {key: value for key, value in params.items() if value is not None}
+        if self.threads is not None:
+            params.setdefault('threads', self.threads)
+        key = hash_inputs(*get_model_arrays(df1, products_price, machine_daily_time), demand, prob, **params)
+
+        request = self._in_flight.get(key)
+        if request is None:
+            inputs = dict(df1=df1, products_price=products_price, machine_daily_time=machine_daily_time, demand=demand, prob=prob, **params)
+            request = _Request(self._manager.Event())
+            request.task = asyncio.ensure_future(self._run(key, request, inputs))
+            self._in_flight[key] = request
+        request.waiters += 1
+        try:
+            # the solve is shielded: it is only stopped when no request is waiting for it
+            solution = await asyncio.wait_for(asyncio.shield(request.task), deadline)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            request.waiters -= 1
+            if request.waiters == 0:
+                # the next identical request starts a new solve
+                request.cancel_solve()
+                if self._in_flight.get(key) is request:
+                    del self._in_flight[key]
+            self.cancelled += 1
+            raise
+        except Exception:
+            self.failed += 1
+            raise
+        self.completed += 1
+        self.latencies.append(time.perf_counter() - start_time)
+        return solution
+
+    def stats(self):
+        #
+        # OUTPUT:
+        # dictionary with the number of queued, running and in flight solves, of completed, cancelled (or expired)
+        # and failed requests and the 50th, 90th and 99th percentiles of the latency in seconds of the completed requests
+        #
+        running = sum(request.started for request in self._in_flight.values())
+        stats = {'queue_depth': len(self._in_flight) - running, 'running': running, 'in_flight': len(self._in_flight),
+                 'completed': self.completed, 'cancelled': self.cancelled, 'failed': self.failed}
+        for q in (50, 90, 99):
+            stats[f'latency_p{q}'] = float(np.percentile(self.latencies, q)) if self.latencies else None
+        return stats
+
+    async def _run(self, key:str, request, inputs:dict):
+        # Waits for a free worker and runs the solver on it
+        try:
+            async with self._slots:
+                request.started = True
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._executor, self.solver, inputs, request.cancel)
+        finally:
+            if self._in_flight.get(key) is request:
+                del self._in_flight[key]
+
+class _Request:
+    # A solve in flight, shared by the identical requests (waiters) that wait for it
+    def __init__(self, cancel):
+        self.cancel = cancel
+        self.task = None
+        self.waiters = 0
+        self.started = False
+
+    def cancel_solve(self):
+        if self.started:
+            # the worker stops the solve with model.terminate() and returns, then its slot is released
+            self.cancel.set()
+        else:
+            self.task.cancel()
+
+def solve_in_worker(inputs:dict, cancel):
+    #
+    # This function builds and solves the model in a worker process of the SolveService
+    # The solve is stopped with model.terminate() when the event cancel is set
+    #
+    # OUTPUT:
+    # solution: backends.ProblemSolution
+    #
+    inputs = dict(inputs)
+    accept_gap = inputs.pop('accept_gap', None)
+    (model_stochastic, y, x) = build_model_variables(**inputs)
+    model_stochastic._cancel = cancel
+    model_stochastic._last_check = 0.0
+    model_stochastic.optimize(_cancel_callback)
+
+    status = model_stochastic.status if model_stochastic.status in (OPTIMAL, INFEASIBLE, UNBOUNDED, TIME_LIMIT) else OTHER
+    # the same solution of gurobi_model_variables: rounded with relaxation = 'round', with all the components and products with presolve
+    result = read_solution(model_stochastic, y, x, accept_gap)
+    if result is not None:
+        solution = ProblemSolution(result.objVal, status, result.Runtime, result.x, result.y, 'gurobi', result.obj_bound, result.mip_gap)
+    else:
+        solution = ProblemSolution(None, status, model_stochastic.Runtime, None, None, 'gurobi')
+    model_stochastic.dispose()
+    return solution
+
+def _cancel_callback(model, where):
+    # Terminates the solve when the cancellation event of the request is set (checked at most every CANCEL_CHECK_INTERVAL seconds)
+    if where == GRB.Callback.POLLING:
+        return
+    now = time.monotonic()
+    if now - model._last_check >= CANCEL_CHECK_INTERVAL:
+        model._last_check = now
+        if model._cancel.is_set():
+            model.terminate()
+
+def stub_solver(inputs:dict, cancel, duration:float = 0.2):
+    # Solver for local tests of the SolveService without gurobi: it waits duration seconds (or until cancel is set)
+    # and returns the expected revenue of producing the whole demand
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        if cancel.is_set():
+            return ProblemSolution(None, OTHER, duration - (end - time.monotonic()), None, None, 'stub')
+        time.sleep(0.01)
+    price = np.fromiter(inputs['products_price'].values(), dtype=float)
+    return ProblemSolution(float(inputs['prob'] @ inputs['demand'] @ price), OPTIMAL, duration, None, None, 'stub')
+
+async def _stub_client():
+    # Sends concurrent requests (some identical, one with a short deadline) to a service with the stub solver
+    df1, products_price, machine_daily_time, products, num_components, num_items, num_machines = get_data()
+    async with SolveService(max_workers=2, solver=functools.partial(stub_solver, duration=0.2)) as service:
+        # the requests are started as tasks, so that they are queued before the stats are printed
+        requests = [asyncio.ensure_future(service.solve(df1, products_price, machine_daily_time, demand=[[100 + k % 4] * num_items])) for k in range(12)]
+        requests.append(asyncio.ensure_future(service.solve(df1, products_price, machine_daily_time, demand=[[50] * num_items], deadline=0.05)))
+        await asyncio.sleep(0.01)
+        print(service.stats())
+        results = await asyncio.gather(*requests, return_exceptions=True)
+        for result in results:
+            print(repr(result) if isinstance(result, Exception) else result.objVal)
+        print(service.stats())
+
+if __name__ == '__main__':
+    asyncio.run(_stub_client())
@@ -0,0 +1,85 @@
+import bisect
+import numpy as np # type: ignore
+
+# Columns of the report: one row for each number of scenarios, with the statistics of the box of all the
+# stability differences computed up to that number of scenarios (as the boxes of matplotlib.pyplot.boxplot)
+COLUMNS = ('n_scenario', 'value', 'count', 'mean', 'whislo', 'q1', 'med', 'q3', 'whishi')
+
+class StabilityReport:
+    #
+    # This class computes incrementally the cumulative box statistics of a stream of stability results
+    # (n_scenario, stability difference): after each result the quartiles, the mean and the whiskers
+    # (the most extreme values within 1.5 times the interquartile range from the quartiles) of all the differences
+    # seen so far are added as a new row, reading them from a sorted list of the differences kept with bisect.
+    # The rows are kept in columns, saved in a compressed npz file with save and plotted with plot_box_stats.
+    #
+    # ATTRIBUTES:
+    # columns: dictionary with a list for each column of COLUMNS
+    #
+    # ATTENTION: the outliers (fliers) are not stored, they would make the report quadratic in the number of results
+    #
+    def __init__(self):
+        self.columns = {column: [] for column in COLUMNS}
+        self._sorted = []
+        self._sum = 0.0
+
+    def add(self, n_scenario:int, value:float):
+        bisect.insort(self._sorted, value)
+        self._sum += value
+        count = len(self._sorted)
+        q1, med, q3 = (self._percentile(q) for q in (0.25, 0.5, 0.75))
+        iqr = q3 - q1
+        # whislo is the smallest value >= q1 - 1.5*iqr, whishi the largest value <= q3 + 1.5*iqr
+        whislo = self._sorted[bisect.bisect_left(self._sorted, q1 - 1.5*iqr)]
+        whishi = self._sorted[bisect.bisect_right(self._sorted, q3 + 1.5*iqr) - 1]
+        for column, entry in zip(COLUMNS, (n_scenario, value, count, self._sum / count, whislo, q1, med, q3, whishi)):
+            self.columns[column].append(entry)
+
+    def extend(self, results):
+        # Adds the results of an iterable of (n_scenario, stability difference), e.g. stability_diff_dict.items()
+        for n_scenario, value in results:
+            self.add(n_scenario, value)
+
+    def save(self, path:str):
+        # Writes the columns in a compressed npz file (one array for each column)
+        np.savez_compressed(path, **{column: np.asarray(values) for column, values in self.columns.items()})
+
+    def _percentile(self, q:float):
+        # Percentile of the differences with linear interpolation, as np.percentile
+        position = q * (len(self._sorted) - 1)
+        lower = int(position)
+        if lower + 1 == len(self._sorted):
+            return self._sorted[lower]
+        return self._sorted[lower] + (self._sorted[lower + 1] - self._sorted[lower]) * (position - lower)
+
+def load_report(path:str):
+    # Returns the columns of a report saved with StabilityReport.save, dictionary of arrays
+    with np.load(path) as data:
+        return {column: data[column] for column in COLUMNS}
+
+def plot_box_stats(columns:dict, title:str, path:str, max_labels:int = 50):
+    #
+    # This function saves in path the boxplots of the cumulative stability differences of a report
+    # (the columns of StabilityReport or of load_report), drawn from the box statistics with Axes.bxp
+    # The plot is drawn with the non-interactive backend Agg, so that it does not need a display
+    #
+    # INPUTS:
+    # max_labels: maximum number of labels of the x axis (the number of scenarios of the boxes)
+    #
+    import matplotlib # type: ignore
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt # type: ignore
+
+    n_boxes = len(columns['n_scenario'])
+    stats = [{key: columns[key][k] for key in ('mean', 'whislo', 'q1', 'med', 'q3', 'whishi')} for k in range(n_boxes)]
+    fig, ax = plt.subplots(figsize=(15, 10))
+    ax.bxp(stats, showfliers=False)
+    ticks = np.arange(1, n_boxes + 1)[::max(1, -(-n_boxes // max_labels))]
+    ax.set_xticks(ticks)
+    ax.set_xticklabels([columns['n_scenario'][k - 1] for k in ticks], rotation=45)
+    ax.hlines(0, 0, n_boxes + 1, colors='r', linestyles='dashed')
+    ax.set_xlabel('Number of scenarios')
+    ax.set_ylabel('Stability difference')
+    ax.set_title(title)
+    fig.savefig(path)
+    plt.close(fig)
@@ -0,0 +1,120 @@
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd # type: ignore
+import numpy as np # type: ignore
+from model import build_model_variables, get_data, get_scenarios # type: ignore
+from instrumentation import SolveRecorder # type: ignore
+
+# Number of working days of the week, the working_hours constraints are machine_daily_time * WORKING_DAYS
+WORKING_DAYS = 7
+CASE_KEYS = ('products_price', 'machine_daily_time', 'working_days')
+
+def solve_what_if(cases:list, df1:pd.DataFrame = None, products_price:dict = None, machine_daily_time:dict = None, demand:list = None, prob:list = None, path:str = None, threads:int = None, n_workers:int = 1, time_limit:float = None, mip_gap:float = None, warm_start:bool = True, recorder:SolveRecorder = None):
+    #
+    # This function solves the ATO problem for a list of what-if cases on the prices of the products and on the
+    # time available on the machines. The model is built once (once per worker) with build_model_variables and,
+    # for every case, only the objective coefficients of y and the right hand side of the working_hours constraints
+    # are changed in place before optimizing it again, starting from the solution of the previous case.
+    #
+    # INPUTS:
+    # cases: list of dictionaries with the overrides of each case with respect to the base data, with the keys
+    #   'products_price': dictionary with the price of some products
+    #   'machine_daily_time': dictionary with the daily time in minutes available for some machines
+    #   'working_days': number of working days of the week (WORKING_DAYS by default)
+    #   every key is optional, {} is the base case
+    # df1, products_price, machine_daily_time, demand, prob, path: base data, as in gurobi_model_variables
+    # threads, time_limit, mip_gap: as in gurobi_model_variables
+    # n_workers: number of processes, the cases are split in n_workers consecutive chunks and each process
+    #   builds its own model and walks through its chunk (1 to solve all the cases in this process)
+    # warm_start: if True the solution of the previous case is the MIP start of the next one
+    # recorder: instrumentation.SolveRecorder where the solve of every case is recorded (with its index 'case'), None to record nothing
+    #
+    # OUTPUT:
+    # table: dataframe with one row for each case (index 'case', in the order of cases) and the columns
+    #   status, objVal and runtime, x_<component> with the number of each component
+    #   and y_<product> with the expected amount of each product (y weighted with the probabilities of the scenarios)
+    #   objVal, x and y are NaN when no solution is found
+    #
+    if df1 is None:
+        df1, products_price, machine_daily_time, products, num_components, num_items, num_machines = get_data(path = path)
+    for case in cases:
+        _check_case(case, products_price, machine_daily_time)
+
+    data = dict(df1=df1, products_price=products_price, machine_daily_time=machine_daily_time, demand=demand, prob=prob,
+                threads=threads, time_limit=time_limit, mip_gap=mip_gap, warm_start=warm_start)
+    if n_workers > 1 and len(cases) > 1:
+        # consecutive cases are usually close to each other, so that the warm start is useful inside every chunk
+        chunks = [chunk for chunk in np.array_split(np.arange(len(cases)), n_workers) if len(chunk) > 0]
+        worker_recorder = None if recorder is None else SolveRecorder(recorder.trajectory, recorder.context)
+        with ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+            futures = [executor.submit(_solve_cases_in_worker, [cases[k] for k in chunk], int(chunk[0]), recorder=worker_recorder, **data) for chunk in chunks]
+            rows = []
+            for future in futures:
+                chunk_rows, records = future.result()
+                rows.extend(chunk_rows)
+                if recorder is not None:
+                    recorder.extend(records)
+    else:
+        rows = _solve_cases(cases, 0, recorder=recorder, **data)
+    return pd.DataFrame(rows).set_index('case')
+
+def _check_case(case:dict, products_price:dict, machine_daily_time:dict):
+    # Raises a ValueError if the case has unknown keys, products or machines
+    unknown = set(case) - set(CASE_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown keys {sorted(unknown)} in the what-if case, the keys are {list(CASE_KEYS)}")
+    unknown = set(case.get('products_price', {})) - set(products_price)
+    if unknown:
+        raise ValueError(f"Unknown products {sorted(unknown)} in the what-if case")
+    unknown = set(case.get('machine_daily_time', {})) - set(machine_daily_time)
+    if unknown:
+        raise ValueError(f"Unknown machines {sorted(unknown)} in the what-if case")
+
+def _solve_cases(cases:list, first:int, df1:pd.DataFrame, products_price:dict, machine_daily_time:dict, demand:list, prob:list, threads:int, time_limit:float, mip_gap:float, warm_start:bool, recorder:SolveRecorder = None):
+    # Builds the model once and solves the cases one after the other, the index of the first case is first
+    # Returns the list of the rows of the table of solve_what_if
+    (model_stochastic, y, x) = build_model_variables(df1 = df1, products_price = products_price, machine_daily_time = machine_daily_time, demand = demand, prob = prob, threads = threads, time_limit = time_limit, mip_gap = mip_gap)
+    demand, prob = get_scenarios(demand, prob, len(products_price))
+    x_columns = [f'x_{component}' for component in df1.index]
+    y_columns = [f'y_{product}' for product in products_price]
+
+    rows = []
+    start = None
+    for k, case in enumerate(cases, start = first):
+        case_price = {**products_price, **case.get('products_price', {})}
+        case_time = {**machine_daily_time, **case.get('machine_daily_time', {})}
+        y.Obj = np.outer(np.fromiter(case_price.values(), dtype=float, count=len(case_price)), prob)
+        model_stochastic._working_hours.RHS = np.fromiter(case_time.values(), dtype=float, count=len(case_time)) * case.get('working_days', WORKING_DAYS)
+        if start is not None:
+            # the previous solution can violate the new working_hours constraints, gurobi then only uses it as a hint to repair
+            x.Start, y.Start = start
+        if recorder is None:
+            model_stochastic.optimize()
+        else:
+            recorder.optimize(model_stochastic, n_scenarios = len(demand), case = k)
+
+        row = {'case': k, 'status': model_stochastic.status, 'runtime': model_stochastic.Runtime}
+        if model_stochastic.SolCount > 0:
+            x_values, y_values = x.X, y.X
+            row['objVal'] = model_stochastic.objVal
+            row.update(zip(x_columns, x_values))
+            row.update(zip(y_columns, y_values @ prob))
+            if warm_start:
+                start = (x_values, y_values)
+        rows.append(row)
+    model_stochastic.dispose()
+    return rows
+
+def _solve_cases_in_worker(cases:list, first:int, recorder:SolveRecorder = None, **data):
+    # Runs _solve_cases in a worker process, returns its rows and the records of the solves (that are not shared between processes)
+    if recorder is None:
+        return (_solve_cases(cases, first, **data), [])
+    recorder.records = []
+    return (_solve_cases(cases, first, recorder = recorder, **data), recorder.records)
+
+if __name__ == '__main__':
+    # Sweep of the price of the first product and of the number of working days on the data of the 'data' folder
+    df1, products_price, machine_daily_time, products, num_components, num_items, num_machines = get_data()
+    cases = [{'products_price': {products[0]: products_price[products[0]] * factor}, 'working_days': days}
+             for days in (5, 6, 7) for factor in (0.8, 0.9, 1.0, 1.1, 1.2)]
+    table = solve_what_if(cases, df1, products_price, machine_daily_time)
+    print(table[['status', 'objVal', f'y_{products[0]}']])